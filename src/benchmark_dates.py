@@ -0,0 +1,52 @@
+import time
+import argparse
+import datetime
+from dateutil import parser
+from populate_from_json import diary_date, calendar_values, calendar_cache
+
+
+# Per record cost of reading an iso8061DateString with dateutil against diary_date, and of working out the
+# calendar columns with strftime and isocalendar for every row against calendar_values, for a diary whose days
+# are each written to rows_per_day tables. Both must give the same values
+def parse_with_dateutil(iso_string):
+    date_time = parser.parse(iso_string)
+    return datetime.date(date_time.year, date_time.month, date_time.day)
+
+
+def calendar_with_strftime(d_date):
+    return (str(d_date), f'{d_date.year}-{d_date.isocalendar()[1]}', f'{d_date.year}-{d_date.strftime("%b")}',
+            d_date.strftime('%a'), d_date.strftime('%b'))
+
+
+def time_per_call(function, arguments):
+    s = time.perf_counter()
+    results = [function(a) for a in arguments]
+    return (time.perf_counter() - s) / len(arguments), results
+
+
+def benchmark(days, rows_per_day):
+    first = datetime.date(2000, 1, 1)
+    dates = [first + datetime.timedelta(days=i) for i in range(days)]
+    strings = [f'{d.isoformat()}T00:00:00Z' for d in dates]
+
+    before, expected = time_per_call(parse_with_dateutil, strings)
+    after, parsed = time_per_call(diary_date, strings)
+    assert parsed == expected, 'parsed dates differ'
+    print(f'    parse: dateutil {before * 1e6:.1f}us, diary_date {after * 1e6:.2f}us ({before / after:.1f}x faster)')
+
+    rows = [d for d in dates for _ in range(rows_per_day)]
+    calendar_cache.clear()
+    before, expected = time_per_call(calendar_with_strftime, rows)
+    after, values = time_per_call(calendar_values, rows)
+    assert values == expected, 'calendar values differ'
+    print(f' calendar: strftime {before * 1e6:.1f}us, calendar_values {after * 1e6:.2f}us per row '
+          f'({before / after:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--days', type=int, default=7300)
+    arg_parser.add_argument('--rows-per-day', type=int, default=30, help='tables each day is written to')
+    args = arg_parser.parse_args()
+
+    benchmark(args.days, args.rows_per_day)
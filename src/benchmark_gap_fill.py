@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import populate_from_json as p
+from synthetic_diary import write_diary
+from diary_reader import DIARY_NAME, iter_days
+from sql_writer import BatchWriter
+from db_connection import connect
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# Loads a synthetic diary, knocks holes in every Day_* table and then fills them again twice: with the per day,
+# per table day_exists probes populate() used to run and with the set based fill_gaps
+def punch_holes(conn, fraction):
+    for t in p.table_list(conn, period=p.DAY):
+        sql_str = f'''
+            DELETE FROM {t}
+            WHERE date > (SELECT MIN(date) FROM {t}) AND ABS(RANDOM()) % 1000 < {int(fraction * 1000)}
+        '''
+        conn.cursor().execute(sql_str)
+    conn.commit()
+
+
+def stage_days(conn):
+    p.create_diary_days_table(conn)
+    with BatchWriter(conn) as writer:
+        for d in iter_days():
+            d_date = p.diary_date(d['iso8061DateString'])
+            p.write_day_rows(writer, [p.diary_day_row(d_date, d['type'], p.values_for_sql(d, p.day_map))])
+
+
+# the probe populate() used to run for every day and table
+def day_exists(d, table, conn):
+    sql_str = f'''
+            SELECT id FROM {table} WHERE date="{d}"
+    '''
+    result = conn.cursor().execute(sql_str)
+    return len(result.fetchall()) > 0
+
+
+def probe_fill(conn):
+    first_dates = dict()
+    for t in p.table_list(conn, period=p.DAY):
+        first_dates[t] = conn.cursor().execute(f'SELECT MIN(date) FROM {t}').fetchone()[0]
+    days = conn.cursor().execute(f'SELECT date, day_type FROM {p.DIARY_DAYS} ORDER BY date').fetchall()
+    columns = ['date'] + p.calendar_columns + p.day_columns
+    queries = 0
+    for d_date, d_type in days:
+        for t, first_date in first_dates.items():
+            queries += 1
+            if first_date <= d_date and not day_exists(d_date, t, conn):
+                queries += 1
+                sql_str = f'INSERT INTO {t} ({",".join(columns)}) SELECT {",".join(columns)} FROM {p.DIARY_DAYS} WHERE date=?'
+                conn.cursor().execute(sql_str, (d_date,))
+    conn.commit()
+    return queries
+
+
+def set_fill(conn):
+    p.fill_gaps(conn)
+    return len(p.table_list(conn, period=p.DAY))
+
+
+def row_count(conn):
+    return sum(conn.cursor().execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0] for t in p.table_list(conn, p.DAY))
+
+
+def benchmark(years, fraction):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        write_diary(DIARY_NAME, years=years)
+        subprocess.run([sys.executable, os.path.join(SRC_DIR, 'create_db.py')], check=True)
+        p.populate()
+
+        conn = connect()
+        full_rows = row_count(conn)
+        punch_holes(conn, fraction)
+        print(f'{years} year diary, {len(p.table_list(conn, p.DAY))} day tables, '
+              f'{full_rows - row_count(conn)} of {full_rows} rows removed')
+
+        for name, fill in [('day_exists probes', probe_fill), ('set based', set_fill)]:
+            copy = connect(db_name=f'{name}.sqlite3')
+            conn.backup(copy)
+            stage_days(copy)
+            s = time.perf_counter()
+            statements = fill(copy)
+            seconds = time.perf_counter() - s
+            print(f'{name:>18}: {seconds:.3f}s, {statements} statements, {row_count(copy)} rows after filling')
+            copy.close()
+        conn.close()
+        os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--years', type=float, default=20)
+    arg_parser.add_argument('--holes', type=float, default=0.2, help='fraction of rows to remove from each table')
+    args = arg_parser.parse_args()
+
+    benchmark(args.years, args.holes)
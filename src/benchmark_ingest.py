@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from synthetic_diary import write_diary
+from diary_reader import DIARY_NAME, iter_days, iter_weights, iter_physiologicals
+from db_connection import connect
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+LOAD = 'load'
+STREAM = 'stream'
+POPULATE = 'populate'
+
+
+# Peak RSS and rows/sec of reading the diary with json.load against the streaming reader, and of a full
+# populate() on top of the streaming reader. Each measurement runs in its own process so peak RSS is not shared
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / (1024 * 1024)
+    return rss / 1024
+
+
+def read_with_json_load():
+    with open(DIARY_NAME) as f:
+        data = json.load(f)
+    rows = 0
+    for key in ['days', 'weights', 'physiologicals']:
+        for d in data.get(key, []):
+            rows += 1 + len(d.get('workouts', []))
+    return rows
+
+
+def read_with_stream():
+    rows = 0
+    for records in [iter_days(), iter_weights(), iter_physiologicals()]:
+        for d in records:
+            rows += 1 + len(d.get('workouts', []))
+    return rows
+
+
+def run_populate():
+    from populate_from_json import populate, table_list
+    subprocess.run([sys.executable, os.path.join(SRC_DIR, 'create_db.py')], check=True)
+    populate()
+    conn = connect()
+    rows = sum(conn.cursor().execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0] for t in table_list(conn))
+    conn.close()
+    return rows
+
+
+def worker(mode):
+    s = time.perf_counter()
+    if mode == LOAD:
+        rows = read_with_json_load()
+    elif mode == STREAM:
+        rows = read_with_stream()
+    else:
+        rows = run_populate()
+    seconds = time.perf_counter() - s
+    print(json.dumps({'mode': mode, 'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds,
+                      'peak_rss_mb': peak_rss_mb()}))
+
+
+def benchmark(years, modes):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        days = write_diary(os.path.join(directory, DIARY_NAME), years=years)
+        size_mb = os.path.getsize(os.path.join(directory, DIARY_NAME)) / (1024 * 1024)
+        print(f'{years} year diary: {days} days, {size_mb:.1f}MB')
+        for mode in modes:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', mode],
+                                    cwd=directory, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:>10}: {result['rows']} rows in {result['seconds']:.2f}s "
+                  f"({result['rows_per_second']:.0f} rows/sec), peak RSS {result['peak_rss_mb']:.1f}MB")
+            results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--years', type=float, default=20)
+    arg_parser.add_argument('--modes', nargs='+', choices=[LOAD, STREAM, POPULATE], default=[LOAD, STREAM, POPULATE])
+    arg_parser.add_argument('--worker', choices=[LOAD, STREAM, POPULATE], help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.worker is not None:
+        worker(args.worker)
+    else:
+        benchmark(args.years, args.modes)
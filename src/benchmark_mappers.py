@@ -0,0 +1,59 @@
+import time
+import random
+import argparse
+import datetime
+from populate_from_json import MAPPER, TYPE, INTEGER, REAL, BOOLEAN, JSON, FACTOR, workout_map, day_map, \
+    values_for_sql
+# the eval in value_string_for_sql looks the mappers up by name in this module
+from populate_from_json import rpe_tss_mapper, mph_mapper, kph_mapper
+from synthetic_diary import synthetic_day, synthetic_workout
+
+
+# Per workout cost of the eval based value_string_for_sql the loader used to run against the compiled
+# extraction plan behind values_for_sql. Both must give the same values
+def value_string_for_sql(dictionary, json_map):
+    d_value_array = []
+    for m in json_map:
+        if MAPPER in m:
+            value = eval(f'{m[MAPPER]}({dictionary})')
+            d_value_array.append(str(value))
+        elif m[TYPE] == INTEGER:
+            d_value_array.append(str(int(round(float(dictionary[m[JSON]]) * m[FACTOR], 0))))
+        elif m[TYPE] == REAL:
+            d_value_array.append(str(round(float(dictionary[m[JSON]]) * m[FACTOR], 2)))
+        elif m[TYPE] == BOOLEAN:
+            if dictionary[m[JSON]] == 0:
+                d_value_array.append('0')
+            else:
+                d_value_array.append('1')
+        else:
+            d_value_array.append(f"'{dictionary[m[JSON]]}'")
+
+    return ','.join([s for s in d_value_array])
+
+
+def time_per_record(function, records, json_map):
+    s = time.perf_counter()
+    results = [function(r, json_map) for r in records]
+    return (time.perf_counter() - s) / len(records), results
+
+
+def benchmark(n, seed=1):
+    rng = random.Random(seed)
+    workouts = [synthetic_workout(rng) for _ in range(n)]
+    days = [synthetic_day(rng, datetime.date(2000, 1, 1) + datetime.timedelta(days=i)) for i in range(n)]
+
+    for name, records, json_map in [('workout', workouts, workout_map), ('day', days, day_map)]:
+        before, strings = time_per_record(value_string_for_sql, records, json_map)
+        after, values = time_per_record(values_for_sql, records, json_map)
+        expected = [','.join(f"'{v}'" if isinstance(v, str) else str(v) for v in row) for row in values]
+        assert strings == expected, f'{name} values differ'
+        print(f'{name:>8}: eval {before * 1e6:.1f}us, plan {after * 1e6:.1f}us ({before / after:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--records', type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    benchmark(args.records)
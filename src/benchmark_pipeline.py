@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import shlex
+import argparse
+import resource
+import tempfile
+import subprocess
+from synthetic_diary import write_diary
+from diary_reader import DIARY_NAME
+from db_connection import DB_NAME
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORT_NAME = 'report.json'
+
+
+# Loads synthetic diaries into a real SQLite file with populate_from_json.py and records the seconds of each stage
+# from its --report, the loader's peak RSS and the size of the database it leaves. Results can be saved with
+# --output and a later run compared against them with --baseline. Each load runs under its own worker process
+# so the peak RSS of one load is not carried into the next
+def peak_children_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / (1024 * 1024)
+    return rss / 1024
+
+
+def worker(loader_args):
+    subprocess.run([sys.executable, os.path.join(SRC_DIR, 'create_db.py')], check=True, capture_output=True)
+    subprocess.run([sys.executable, os.path.join(SRC_DIR, 'populate_from_json.py'), '--report', REPORT_NAME]
+                   + loader_args, check=True, capture_output=True)
+    print(json.dumps({'peak_rss_mb': peak_children_rss_mb()}))
+
+
+def database_size_mb(directory):
+    size = 0
+    for suffix in ['', '-wal', '-shm']:
+        path = os.path.join(directory, DB_NAME + suffix)
+        if os.path.exists(path):
+            size += os.path.getsize(path)
+    return size / (1024 * 1024)
+
+
+def load(directory, loader_args):
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(os.path.join(directory, DB_NAME + suffix)):
+            os.remove(os.path.join(directory, DB_NAME + suffix))
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker',
+                             f'--loader-args={shlex.join(loader_args)}'],
+                            cwd=directory, check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    with open(os.path.join(directory, REPORT_NAME)) as f:
+        report = json.load(f)
+    result['seconds'] = report['seconds']
+    result['stages'] = {s['name']: s['seconds'] for s in report['stages']}
+    result['rows'] = sum(s['rows'] for s in report['stages'] if s['within'] is None)
+    result['db_size_mb'] = database_size_mb(directory)
+    return result
+
+
+# the fastest of repeat loads for each stage and the largest peak RSS
+def benchmark(years, workouts, equipment, loader_args, repeat=1):
+    diary = f'{years:g} years, up to {workouts} workouts a day, equipment {equipment or "default"}'
+    name = diary
+    if len(loader_args) > 0:
+        name += f', {shlex.join(loader_args)}'
+    with tempfile.TemporaryDirectory() as directory:
+        days = write_diary(os.path.join(directory, DIARY_NAME), years=years, workouts=workouts, equipment=equipment)
+        runs = [load(directory, loader_args) for _ in range(repeat)]
+
+    result = {'name': name, 'diary': diary, 'days': days,
+              'seconds': min(r['seconds'] for r in runs),
+              'stages': {s: min(r['stages'][s] for r in runs) for s in runs[0]['stages']},
+              'rows': runs[0]['rows'],
+              'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+              'db_size_mb': runs[0]['db_size_mb']}
+    print(f"{name}: {days} days, {result['rows']} rows in {result['seconds']:.2f}s, "
+          f"peak RSS {result['peak_rss_mb']:.1f}MB, database {result['db_size_mb']:.1f}MB")
+    return result
+
+
+def print_stages(result, baseline=None):
+    for stage, seconds in list(result['stages'].items()) + [('total', result['seconds'])]:
+        line = f'{stage:>16}: {seconds:8.3f}s'
+        if baseline is not None:
+            before = baseline['stages'].get(stage, baseline['seconds'] if stage == 'total' else None)
+            if before is not None and seconds > 0:
+                line += f'  baseline {before:8.3f}s  {before / seconds:5.2f}x speedup'
+        print(line)
+    if baseline is not None:
+        print(f"{'peak RSS':>16}: {result['peak_rss_mb']:8.1f}MB baseline {baseline['peak_rss_mb']:8.1f}MB")
+        print(f"{'database':>16}: {result['db_size_mb']:8.1f}MB baseline {baseline['db_size_mb']:8.1f}MB")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--years', type=float, nargs='+', default=[20])
+    arg_parser.add_argument('--workouts', type=int, default=3, help='most workouts on a training day')
+    arg_parser.add_argument('--equipment', type=int, help='named pieces of equipment per activity')
+    arg_parser.add_argument('--loader-args', default='',
+                            help='options passed on to populate_from_json.py, as --loader-args="--columnar --workers 2"')
+    arg_parser.add_argument('--repeat', type=int, default=1)
+    arg_parser.add_argument('--output', help='save the results to this JSON file')
+    arg_parser.add_argument('--baseline', help='compare against results saved with --output')
+    arg_parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.worker:
+        worker(shlex.split(args.loader_args))
+    else:
+        # a baseline is matched on the diary so loads with different --loader-args can be compared
+        baselines = dict()
+        if args.baseline is not None:
+            with open(args.baseline) as f:
+                baselines = {r['diary']: r for r in json.load(f)}
+        results = []
+        for years in args.years:
+            result = benchmark(years, args.workouts, args.equipment, shlex.split(args.loader_args), args.repeat)
+            print_stages(result, baselines.get(result['diary']))
+            results.append(result)
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
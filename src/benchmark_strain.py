@@ -0,0 +1,78 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from populate_from_json import STRAIN_WINDOW_DAYS
+from rolling_stats import RollingWindow
+
+
+# Times the four pandas rolling passes calculate_monotony_strain used to run against RollingWindow on synthetic
+# tss series, checks both give the same values and that extending the window a block at a time, as an append only
+# load does, gives the same values as one pass
+def strain_pandas(tss, rpe_tss):
+    df = pd.DataFrame({'tss': tss, 'rpe_tss': rpe_tss})
+    df['tss_stdev'] = df['tss'].rolling(7, min_periods=0).std().clip(lower=0.01)
+    df['rpe_tss_stdev'] = df['rpe_tss'].rolling(7, min_periods=0).std().clip(lower=0.01)
+    df['monotony'] = df['tss'].rolling(7, min_periods=1).mean() / df['tss_stdev']
+    df['strain'] = df['tss'].rolling(7, min_periods=1).sum() * df['monotony']
+    df['rpe_monotony'] = df['rpe_tss'].rolling(7, min_periods=1).mean() / df['rpe_tss_stdev']
+    df['rpe_strain'] = df['rpe_tss'].rolling(7, min_periods=1).sum() * df['rpe_monotony']
+    df.fillna(0, inplace=True)
+    return df[['monotony', 'strain', 'rpe_monotony', 'rpe_strain']].to_numpy()
+
+
+def strain_window(tss, rpe_tss, block=None):
+    window = RollingWindow(STRAIN_WINDOW_DAYS, 2)
+    values = np.column_stack([tss, rpe_tss])
+    if block is None:
+        block = len(values)
+    results = []
+    for i in range(0, len(values), block):
+        sums, means, stds = window.extend(values[i:i + block])
+        monotony = means / np.clip(stds, 0.01, None)
+        results.append(np.column_stack([monotony[:, 0], (sums * monotony)[:, 0],
+                                        monotony[:, 1], (sums * monotony)[:, 1]]))
+    results = np.concatenate(results)
+    results[np.isnan(results)] = 0
+    return results
+
+
+def relative_difference(a, b):
+    return np.max(np.abs(a - b) / np.maximum(1, np.abs(a)))
+
+
+def benchmark(years, tables, seed=1):
+    rng = np.random.default_rng(seed)
+    days = int(round(years * 365.25))
+    series = []
+    for _ in range(tables):
+        rest = rng.random(days) < 0.3
+        series.append((np.where(rest, 0, rng.integers(0, 300, days)).astype(float),
+                       np.where(rest, 0, rng.uniform(0, 250, days).round(1))))
+
+    s = time.perf_counter()
+    pandas_results = [strain_pandas(tss, rpe_tss) for tss, rpe_tss in series]
+    pandas_seconds = time.perf_counter() - s
+
+    s = time.perf_counter()
+    window_results = [strain_window(tss, rpe_tss) for tss, rpe_tss in series]
+    window_seconds = time.perf_counter() - s
+
+    block_results = [strain_window(tss, rpe_tss, block=30) for tss, rpe_tss in series]
+
+    max_difference = max(relative_difference(a, b) for a, b in zip(pandas_results, window_results))
+    block_difference = max(relative_difference(a, b) for a, b in zip(window_results, block_results))
+    print(f'{tables} tables of {days} days')
+    print(f'pandas rolling: {pandas_seconds:.3f}s')
+    print(f' RollingWindow: {window_seconds:.3f}s ({pandas_seconds / window_seconds:.1f}x faster)')
+    print(f'max relative difference: {max_difference:.3e}, appending 30 days at a time: {block_difference:.3e}')
+    return pandas_seconds, window_seconds, max_difference
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--years', type=float, default=20)
+    arg_parser.add_argument('--tables', type=int, default=100)
+    args = arg_parser.parse_args()
+
+    benchmark(args.years, args.tables)
@@ -0,0 +1,58 @@
+import time
+import argparse
+import numpy as np
+from populate_from_json import CTL_DECAY, CTL_IMPACT, ATL_DECAY, ATL_IMPACT, exponential_load
+
+
+# Times the per row ctl/atl/tsb recursion calculate_tsb used to run against the lfilter engine on synthetic
+# tss series and checks both give the same values
+def tsb_loop(tss, rpe_tss):
+    atl = ctl = rpe_atl = rpe_ctl = 0.0
+    rows = []
+    for t, r in zip(tss, rpe_tss):
+        ctl = t * CTL_IMPACT + ctl * CTL_DECAY
+        atl = t * ATL_IMPACT + atl * ATL_DECAY
+        tsb = ctl - atl
+        rpe_ctl = r * CTL_IMPACT + rpe_ctl * CTL_DECAY
+        rpe_atl = r * ATL_IMPACT + rpe_atl * ATL_DECAY
+        rpe_tsb = rpe_ctl - rpe_atl
+        rows.append((ctl, atl, tsb, rpe_ctl, rpe_atl, rpe_tsb))
+    return np.array(rows)
+
+
+def tsb_vectorized(tss, rpe_tss):
+    ctl = exponential_load(tss, CTL_IMPACT, CTL_DECAY)
+    atl = exponential_load(tss, ATL_IMPACT, ATL_DECAY)
+    rpe_ctl = exponential_load(rpe_tss, CTL_IMPACT, CTL_DECAY)
+    rpe_atl = exponential_load(rpe_tss, ATL_IMPACT, ATL_DECAY)
+    return np.column_stack([ctl, atl, ctl - atl, rpe_ctl, rpe_atl, rpe_ctl - rpe_atl])
+
+
+def benchmark(years, tables, seed=1):
+    rng = np.random.default_rng(seed)
+    days = int(round(years * 365.25))
+    series = [(rng.integers(0, 300, days).astype(float), rng.uniform(0, 250, days).round(1)) for _ in range(tables)]
+
+    s = time.perf_counter()
+    loop_results = [tsb_loop(tss.tolist(), rpe_tss.tolist()) for tss, rpe_tss in series]
+    loop_seconds = time.perf_counter() - s
+
+    s = time.perf_counter()
+    vectorized_results = [tsb_vectorized(tss, rpe_tss) for tss, rpe_tss in series]
+    vectorized_seconds = time.perf_counter() - s
+
+    max_difference = max(np.max(np.abs(a - b)) for a, b in zip(loop_results, vectorized_results))
+    print(f'{tables} tables of {days} days')
+    print(f'      loop: {loop_seconds:.3f}s')
+    print(f'vectorized: {vectorized_seconds:.3f}s ({loop_seconds / vectorized_seconds:.1f}x faster)')
+    print(f'max difference: {max_difference:.3e}')
+    return loop_seconds, vectorized_seconds, max_difference
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--years', type=float, default=20)
+    arg_parser.add_argument('--tables', type=int, default=100)
+    args = arg_parser.parse_args()
+
+    benchmark(args.years, args.tables)
@@ -0,0 +1,79 @@
+import sys
+import argparse
+from db_connection import DB_NAME, SERVING, connect
+from populate_from_json import DAY, WEEK, MONTH
+
+SAMPLE_DATE = '2000-01-01'
+
+# The queries the loader and the dashboards run most, as (name, period, sql, parameters). {table} is filled in
+# with each table of the period, or left out when period is None
+representative_queries = [
+    ('catalog lookup', None,
+     'SELECT table_name FROM Tables WHERE period=? AND activity=? AND activity_type=? AND equipment=?',
+     [DAY, 'All', 'All', 'All']),
+    ('catalog by period', None, 'SELECT table_name FROM Tables WHERE period=?', [DAY]),
+    ('tsb and strain read', DAY, 'SELECT id, tss, rpe_tss FROM {table} ORDER BY date', []),
+    ('tsb and strain read since', DAY, 'SELECT id, tss, rpe_tss FROM {table} WHERE date>=? ORDER BY date',
+     [SAMPLE_DATE]),
+    ('tsb seed', DAY, 'SELECT ctl, atl, rpe_ctl, rpe_atl FROM {table} WHERE date<? ORDER BY date DESC LIMIT 1',
+     [SAMPLE_DATE]),
+    ('strain seed', DAY, 'SELECT tss, rpe_tss FROM {table} WHERE date<? ORDER BY date DESC LIMIT 6', [SAMPLE_DATE]),
+    ('delete day', DAY, 'SELECT id FROM {table} WHERE date=?', [SAMPLE_DATE]),
+    ('date range', DAY, 'SELECT date, ctl, atl, tsb, km FROM {table} WHERE date>=? AND date<=? ORDER BY date',
+     [SAMPLE_DATE, SAMPLE_DATE]),
+    ('day type', DAY, 'SELECT date, tss FROM {table} WHERE day_type=? AND date>=? ORDER BY date',
+     ['Race', SAMPLE_DATE]),
+    ('week periods since', DAY, 'SELECT year_week FROM {table} WHERE date>=?', [SAMPLE_DATE]),
+    ('week rollup', DAY, 'SELECT year_week, SUM(tss) FROM {table} WHERE year_week IN (?, ?) GROUP BY year_week',
+     ['2000-1', '2000-2']),
+    ('month rollup', DAY, 'SELECT year_month, SUM(tss) FROM {table} WHERE year_month IN (?, ?) GROUP BY year_month',
+     ['2000-Jan', '2000-Feb']),
+    ('week rebuild', WEEK, 'SELECT id FROM {table} WHERE year_week IN (?, ?)', ['2000-1', '2000-2']),
+    ('week date range', WEEK, 'SELECT date, tss, km FROM {table} WHERE date>=? AND date<=? ORDER BY date',
+     [SAMPLE_DATE, SAMPLE_DATE]),
+    ('month rebuild', MONTH, 'SELECT id FROM {table} WHERE year_month IN (?, ?)', ['2000-Jan', '2000-Feb']),
+    ('month date range', MONTH, 'SELECT date, tss, km FROM {table} WHERE date>=? AND date<=? ORDER BY date',
+     [SAMPLE_DATE, SAMPLE_DATE]),
+]
+
+
+# Runs EXPLAIN QUERY PLAN on each of representative_queries against the warehouse and reports the ones whose plan
+# reads a whole table. Scanning a covering index is allowed, the loader's full reads cannot do better than that
+def full_scans(plan):
+    return [detail for _, _, _, detail in plan if detail.startswith('SCAN ') and 'COVERING INDEX' not in detail]
+
+
+# returns [(query name, table, sql, full scans)] for the plans that scan a table. With sample only the first
+# table of each period is checked
+def check_query_plans(conn, sample=False):
+    failures = []
+    for name, period, sql_str, parameters in representative_queries:
+        tables = [None]
+        if period is not None:
+            sql = 'SELECT table_name FROM Tables WHERE period=? ORDER BY id'
+            tables = [r[0] for r in conn.execute(sql, (period,))]
+            if sample:
+                tables = tables[:1]
+        for table_name in tables:
+            query = sql_str.format(table=table_name)
+            scans = full_scans(conn.execute(f'EXPLAIN QUERY PLAN {query}', parameters).fetchall())
+            if len(scans) > 0:
+                failures.append((name, table_name, query, scans))
+    return failures
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--db', default=DB_NAME)
+    arg_parser.add_argument('--sample', action='store_true', help='check only the first table of each period')
+    args = arg_parser.parse_args()
+
+    conn = connect(SERVING, args.db)
+    failures = check_query_plans(conn, args.sample)
+    conn.close()
+
+    for name, table_name, query, scans in failures:
+        print(f'{name} on {table_name}: {"; ".join(scans)}\n    {query}')
+    print(f'{len(representative_queries)} queries checked, {len(failures)} full table scans')
+    if len(failures) > 0:
+        sys.exit(1)
@@ -1,7 +1,7 @@
-import sqlite3
+from db_connection import BULK_LOAD, connect
 
 
-conn = sqlite3.connect('training_data_warehouse.sqlite3')
+conn = connect(BULK_LOAD)
 c = conn.cursor()
 
 
@@ -17,4 +17,29 @@ try:
 
 except Exception as e:
     print(e)
-    pass
\ No newline at end of file
+    pass
+
+
+try:
+    c.execute('''CREATE TABLE LoadState
+        (record_type VARCHAR(32),
+        date DATE,
+        hash VARCHAR(40),
+        PRIMARY KEY (record_type, date))
+    ''')
+
+except Exception as e:
+    print(e)
+    pass
+
+
+try:
+    c.execute('''CREATE TABLE LoadGeneration
+        (id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER,
+        loaded TIMESTAMP)
+    ''')
+
+except Exception as e:
+    print(e)
+    pass
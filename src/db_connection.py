@@ -0,0 +1,106 @@
+import os
+import sqlite3
+import tempfile
+
+DB_NAME = 'training_data_warehouse.sqlite3'
+BUSY_TIMEOUT = 60.0
+# sqlite3 keeps this many compiled statements per connection. The loader uses a few per table
+STATEMENT_CACHE_SIZE = 1024
+MEMORY = 'memory'
+MEMORY_URI = 'file:training_data_warehouse_build?mode=memory&cache=shared'
+
+DEFAULT_PROFILE = 'default'
+BULK_LOAD = 'bulk_load'
+SHARED_LOAD = 'shared_load'
+SERVING = 'serving'
+
+# Pragmas run, in order, on every connection opened with the profile. BULK_LOAD is for rebuilding the warehouse:
+# nothing is synced to disk, the page cache is large and the file is locked exclusively until the connection
+# closes, so it waits for and then fails on any other connection that has the file open. SHARED_LOAD is the same
+# without the exclusive lock, for loads that other connections read during, such as dashboards and the derived
+# stage's worker processes, and is what the loader uses unless told otherwise. SERVING is for dashboards reading
+# while a refresh runs: WAL keeps readers going during a write, pages are read through mmap and the connection
+# refuses to write
+profiles = {
+    DEFAULT_PROFILE: [],
+    BULK_LOAD: [('locking_mode', 'EXCLUSIVE'),
+                ('journal_mode', 'WAL'),
+                ('synchronous', 'OFF'),
+                ('cache_size', -256 * 1024),
+                ('temp_store', 'MEMORY')],
+    SHARED_LOAD: [('journal_mode', 'WAL'),
+                  ('synchronous', 'OFF'),
+                  ('cache_size', -256 * 1024),
+                  ('temp_store', 'MEMORY')],
+    SERVING: [('journal_mode', 'WAL'),
+              ('synchronous', 'NORMAL'),
+              ('mmap_size', 256 * 1024 * 1024),
+              ('cache_size', -64 * 1024),
+              ('query_only', 'ON')],
+}
+
+# the profiles a load can write through, SERVING refuses writes
+load_profiles = [BULK_LOAD, SHARED_LOAD, DEFAULT_PROFILE]
+
+
+# the database connect() opens when no db_name is given. start_build points it at the scratch build
+database = DB_NAME
+build_anchor = None
+
+
+# the one place connections to the warehouse are opened
+def connect(profile=DEFAULT_PROFILE, db_name=None, timeout=BUSY_TIMEOUT):
+    if db_name is None:
+        db_name = database
+    conn = sqlite3.connect(db_name, timeout=timeout, uri=True, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma, value in profiles[profile]:
+        conn.cursor().execute(f'PRAGMA {pragma}={value}')
+    return conn
+
+
+# Sends every connect() to a scratch copy of the warehouse until finish_build swaps it into place, so readers of
+# the warehouse never see a partly built one. target is MEMORY for an in-memory database shared by the
+# connections of this process, or a directory such as /dev/shm for a scratch file other processes can open too
+def start_build(target, db_name=DB_NAME):
+    global database, build_anchor
+
+    if target == MEMORY:
+        database = MEMORY_URI
+    else:
+        handle, database = tempfile.mkstemp(suffix='.sqlite3', dir=target)
+        os.close(handle)
+    # an in-memory database lasts as long as a connection to it is open
+    build_anchor = connect(DEFAULT_PROFILE)
+    if os.path.exists(db_name):
+        source = connect(DEFAULT_PROFILE, db_name)
+        source.backup(build_anchor)
+        source.close()
+
+
+# Copies the build next to db_name with the backup API and renames it over db_name. The copy is left in rollback
+# journal mode and the old file's WAL is checkpointed and emptied first, as SQLite would otherwise replay WAL
+# frames left from the old file onto the new one. Readers that have the old file open read it until they reconnect
+def finish_build(db_name=DB_NAME):
+    global database, build_anchor
+
+    build_anchor.cursor().execute('PRAGMA journal_mode=DELETE')
+    building = f'{db_name}.building'
+    if os.path.exists(building):
+        os.remove(building)
+    copy = connect(DEFAULT_PROFILE, building)
+    build_anchor.backup(copy)
+    copy.close()
+
+    if os.path.exists(db_name):
+        old = connect(DEFAULT_PROFILE, db_name)
+        old.cursor().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        old.close()
+    os.replace(building, db_name)
+
+    build_anchor.close()
+    if database != MEMORY_URI:
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+    database = DB_NAME
+    build_anchor = None
@@ -0,0 +1,107 @@
+import json
+
+DIARY_NAME = 'TrainingDiary.json'
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\r\n'
+
+
+# Streams the top level arrays of TrainingDiary.json one record at a time so the diary is never held in memory
+# as a whole. Each call re-reads the file and skips over the other arrays record by record.
+def iter_days(path=DIARY_NAME):
+    return iter_json_array(path, 'days')
+
+
+def iter_weights(path=DIARY_NAME):
+    return iter_json_array(path, 'weights')
+
+
+def iter_physiologicals(path=DIARY_NAME):
+    return iter_json_array(path, 'physiologicals')
+
+
+def iter_json_array(path, key):
+    with open(path, encoding='utf-8') as f:
+        stream = JsonStream(f)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            name = stream.value()
+            stream.expect(':')
+            if stream.peek() == '[':
+                for element in stream.array():
+                    if name == key:
+                        yield element
+            else:
+                stream.value()
+            if name == key:
+                return
+            if stream.next() == '}':
+                return
+
+
+class JsonStream:
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        chunk = self.f.read(CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    # next non whitespace character without consuming it, None at the end of the file
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def next(self):
+        c = self.peek()
+        if c is None:
+            raise ValueError('Unexpected end of JSON')
+        self.pos += 1
+        return c
+
+    def expect(self, expected):
+        c = self.next()
+        if c != expected:
+            raise ValueError(f'Expected "{expected}" but found "{c}"')
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number running up to the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.next()
+            return
+        while True:
+            yield self.value()
+            c = self.next()
+            if c == ']':
+                return
+            if c != ',':
+                raise ValueError(f'Expected "," or "]" but found "{c}"')
@@ -0,0 +1,122 @@
+import sys
+import json
+import time
+import cProfile
+import datetime
+import tracemalloc
+from contextlib import contextmanager
+
+
+# Where a run spends its time: seconds, rows written and SQL statements executed per stage and, for the stages
+# that work table by table, per table. Stages can nest and a nested stage's time is part of its parent's too.
+# The loader keeps one report per process in report below and writes it out as JSON for the nightly job
+class RunReport:
+
+    def __init__(self):
+        self.started = datetime.datetime.now()
+        self.stages = dict()
+        self.current = None
+        self.profiler = None
+        self.tracing = False
+
+    def stage_entry(self, name):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = {'name': name, 'within': None if self.current is None else self.current['name'],
+                     'seconds': 0.0, 'rows': 0, 'statements': 0, 'tables': dict()}
+            self.stages[name] = entry
+        return entry
+
+    # yields the stage's entry so callers can add their own figures to it
+    @contextmanager
+    def stage(self, name):
+        entry = self.stage_entry(name)
+        parent = self.current
+        self.current = entry
+        print(f'{name} ...')
+        if self.tracing:
+            tracemalloc.reset_peak()
+        s = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            seconds = time.perf_counter() - s
+            entry['seconds'] += seconds
+            if self.tracing:
+                # a nested stage resets the peak, so a parent also keeps the largest of its children's peaks
+                peak = max(entry.get('peak_traced_mb', 0.0), tracemalloc.get_traced_memory()[1] / (1024 * 1024))
+                entry['peak_traced_mb'] = peak
+                if parent is not None:
+                    parent['peak_traced_mb'] = max(parent.get('peak_traced_mb', 0.0), peak)
+            self.current = parent
+            print(f'DONE in {datetime.timedelta(seconds=seconds)}')
+
+    @contextmanager
+    def table(self, table_name):
+        entry = self.table_entry(table_name)
+        s = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            if entry is not None:
+                entry['seconds'] += time.perf_counter() - s
+
+    def table_entry(self, table_name):
+        if self.current is None:
+            return None
+        return self.current['tables'].setdefault(table_name, {'seconds': 0.0, 'rows': 0, 'statements': 0})
+
+    def count(self, rows=0, statements=1, table_name=None):
+        if self.current is None:
+            return
+        self.current['rows'] += max(rows, 0)
+        self.current['statements'] += statements
+        if table_name is not None:
+            entry = self.table_entry(table_name)
+            entry['rows'] += max(rows, 0)
+            entry['statements'] += statements
+
+    # passes the items of iterable through, adding the time spent producing them to the named stage
+    def timed(self, iterable, name):
+        entry = self.stage_entry(name)
+        iterator = iter(iterable)
+        while True:
+            s = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                entry['seconds'] += time.perf_counter() - s
+                return
+            entry['seconds'] += time.perf_counter() - s
+            entry['rows'] += 1
+            yield item
+
+    def start_profiler(self):
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def start_tracemalloc(self):
+        tracemalloc.start()
+        self.tracing = True
+
+    def as_dict(self):
+        result = {'started': self.started.isoformat(timespec='seconds'),
+                  'seconds': (datetime.datetime.now() - self.started).total_seconds(),
+                  'arguments': sys.argv[1:],
+                  'stages': list(self.stages.values())}
+        if self.tracing:
+            result['peak_traced_mb'] = max([s.get('peak_traced_mb', 0.0) for s in self.stages.values()] + [0.0])
+        return result
+
+    # profile_path gets the cProfile stats, readable with pstats, when the profiler was started
+    def write(self, path=None, profile_path=None):
+        if self.profiler is not None:
+            self.profiler.disable()
+            if profile_path is not None:
+                self.profiler.dump_stats(profile_path)
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(self.as_dict(), f, indent=2)
+
+
+report = RunReport()
@@ -0,0 +1,199 @@
+import argparse
+import numpy as np
+from db_connection import BULK_LOAD, SHARED_LOAD, connect
+from populate_from_json import DAY, TYPE, DB_COL, REAL, INTEGER, BOOLEAN, day_map, workout_map, table_list, \
+    exponential_loads
+from instrumentation import report
+from run_ledger import ledger
+
+LOAD_MODELS = 'LoadModels'
+MODEL_LOADS = 'ModelLoads'
+MODEL_LOAD_COLUMNS = ['model', 'table_name', 'date', 'value']
+
+# the numeric day and workout columns a model can be driven by
+model_metrics = [m[DB_COL] for m in day_map + workout_map if m[TYPE] in [REAL, INTEGER, BOOLEAN]]
+
+
+def create_load_model_tables(conn):
+    sql_str = f'''
+        CREATE TABLE IF NOT EXISTS {LOAD_MODELS}
+        (model VARCHAR(32) PRIMARY KEY,
+        metric VARCHAR(32),
+        decay_days REAL,
+        impact_days REAL)
+    '''
+    conn.cursor().execute(sql_str)
+
+    # one row per model, Day table and date so any number of models fit without changing the schema
+    sql_str = f'''
+        CREATE TABLE IF NOT EXISTS {MODEL_LOADS}
+        (model VARCHAR(32),
+        table_name VARCHAR(100),
+        date DATE,
+        value REAL,
+        PRIMARY KEY (model, table_name, date))
+        WITHOUT ROWID
+    '''
+    conn.cursor().execute(sql_str)
+
+
+# [(model, metric, decay days, impact days)] in model order
+def stored_models(conn):
+    sql_str = f'SELECT name FROM sqlite_master WHERE type="table" AND name="{LOAD_MODELS}"'
+    if conn.cursor().execute(sql_str).fetchone() is None:
+        return []
+    sql_str = f'SELECT model, metric, decay_days, impact_days FROM {LOAD_MODELS} ORDER BY model'
+    return conn.cursor().execute(sql_str).fetchall()
+
+
+# Adds or redefines models and works out their loads from the first day. Each model is an exponentially weighted
+# load of metric, the same recursion as ctl and atl with its own decay and impact time constants in days
+def add_models(models, profile=BULK_LOAD):
+    errors = model_errors(models)
+    if len(errors) > 0:
+        raise ValueError('; '.join(errors))
+
+    conn = connect(profile)
+    create_load_model_tables(conn)
+    conn.cursor().executemany(f'INSERT OR REPLACE INTO {LOAD_MODELS} (model, metric, decay_days, impact_days) '
+                              f'VALUES (?, ?, ?, ?)', models)
+    conn.commit()
+    conn.close()
+    calculate_load_models(None, profile, [m[0] for m in models])
+
+
+def model_errors(models):
+    errors = []
+    for model, metric, decay_days, impact_days in models:
+        if metric not in model_metrics:
+            errors.append(f'{model}: {metric} is not one of {", ".join(model_metrics)}')
+        if decay_days <= 0 or impact_days <= 0:
+            errors.append(f'{model}: time constants must be positive')
+    return errors
+
+
+def remove_models(names, profile=BULK_LOAD):
+    conn = connect(profile)
+    create_load_model_tables(conn)
+    for model in names:
+        conn.cursor().execute(f'DELETE FROM {MODEL_LOADS} WHERE model=?', (model,))
+        conn.cursor().execute(f'DELETE FROM {LOAD_MODELS} WHERE model=?', (model,))
+    conn.commit()
+    conn.close()
+
+
+# Works out the stored models, or those named in only, for every Day table. The tables' metrics are laid out on
+# the dates any of them has a row for as a dates x (models x tables) matrix and every column is filtered in one
+# exponential_loads call, so a further model costs another column rather than another pass over the tables. The
+# gap fill gives a table a row for every diary day from its first, so each step is one of its rows as in
+# tsb_rows, and dates before a table's first row are zero and leave its loads at zero. With since the loads are
+# rewritten from since on, each series seeded with its load on the last date before since. The loader's ledger
+# records the stage as it commits
+def calculate_load_models(since=None, profile=BULK_LOAD, only=None):
+    if ledger.is_done('load models'):
+        return
+    conn = connect(profile)
+    models = [m for m in stored_models(conn) if only is None or m[0] in only]
+    if len(models) == 0:
+        conn.close()
+        return
+
+    with report.stage('load models') as stage:
+        tables = table_list(conn, period=DAY)
+        metrics = sorted(set(m[1] for m in models))
+        names = [m[0] for m in models]
+
+        # the loads of dates a run removed go too, there may be no rows left from since on to replace them
+        delete_str = f'DELETE FROM {MODEL_LOADS} WHERE model IN ({",".join("?" for _ in names)})'
+        if since is not None:
+            delete_str += f' AND date >= "{since}"'
+        conn.cursor().execute(delete_str, names)
+
+        table_rows = [table_metrics(conn, table_name, metrics, since) for table_name in tables]
+        dates = np.unique(np.concatenate([np.array([], dtype='datetime64[D]')] +
+                                         [np.array([r[0] for r in rows], dtype='datetime64[D]')
+                                          for rows in table_rows]))
+
+        # metric -> dates x tables, and which dates each table has a row for
+        values = {metric: np.zeros((len(dates), len(tables))) for metric in metrics}
+        present = np.zeros((len(dates), len(tables)), dtype=bool)
+        for j, rows in enumerate(table_rows):
+            if len(rows) == 0:
+                continue
+            columns = list(zip(*rows))
+            days = np.searchsorted(dates, np.array(columns[0], dtype='datetime64[D]'))
+            present[days, j] = True
+            for metric, column in zip(metrics, columns[1:]):
+                values[metric][days, j] = np.array(column, dtype=float)
+
+        initial = np.zeros((len(models), len(tables)))
+        if since is not None and len(dates) > 0:
+            initial = seed_loads(conn, models, tables, since)
+
+        loads = exponential_loads(np.concatenate([values[m[1]] for m in models], axis=1),
+                                  np.repeat([m[2] for m in models], len(tables)),
+                                  np.repeat([m[3] for m in models], len(tables)),
+                                  initial.reshape(-1))
+
+        # a series is one statement so it goes straight to executemany rather than row by row through a BatchWriter
+        insert_str = f'INSERT INTO {MODEL_LOADS} ({", ".join(MODEL_LOAD_COLUMNS)}) VALUES (?, ?, ?, ?)'
+        dates = dates.astype(str)
+        for i, model in enumerate(names):
+            for j, table_name in enumerate(tables):
+                days = np.flatnonzero(present[:, j])
+                series = loads[days, i * len(tables) + j]
+                conn.cursor().executemany(insert_str, zip([model] * len(days), [table_name] * len(days),
+                                                          dates[days].tolist(), series.tolist()))
+                report.count(len(days), table_name=table_name)
+        stage['models'] = len(models)
+
+    ledger.done(conn, 'load models')
+    conn.commit()
+    conn.close()
+
+
+# [(date, metric, ...)] of the table's rows from since on in date order
+def table_metrics(conn, table_name, metrics, since):
+    sql_str = f'SELECT date, {", ".join(metrics)} FROM {table_name}'
+    parameters = []
+    if since is not None:
+        sql_str += ' WHERE date >= ?'
+        parameters.append(str(since))
+    return conn.cursor().execute(sql_str + ' ORDER BY date', parameters).fetchall()
+
+
+# models x tables of each series' load on its last date before since, zero for a series with none
+def seed_loads(conn, models, tables, since):
+    initial = np.zeros((len(models), len(tables)))
+    sql_str = f'''
+        SELECT value FROM {MODEL_LOADS}
+        WHERE model=? AND table_name=? AND date < ?
+        ORDER BY date DESC LIMIT 1
+    '''
+    for i, model in enumerate(m[0] for m in models):
+        for j, table_name in enumerate(tables):
+            row = conn.cursor().execute(sql_str, (model, table_name, str(since))).fetchone()
+            if row is not None:
+                initial[i, j] = row[0]
+    return initial
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--add', nargs=4, action='append', metavar=('MODEL', 'METRIC', 'DECAY_DAYS', 'IMPACT_DAYS'),
+                            help=f'add or redefine a model, METRIC one of {", ".join(model_metrics)}')
+    arg_parser.add_argument('--remove', nargs='+', metavar='MODEL')
+    args = arg_parser.parse_args()
+
+    if args.remove is not None:
+        remove_models(args.remove, SHARED_LOAD)
+    if args.add is not None:
+        new_models = [(model, metric, float(decay), float(impact)) for model, metric, decay, impact in args.add]
+        if len(model_errors(new_models)) > 0:
+            arg_parser.error('; '.join(model_errors(new_models)))
+        add_models(new_models, SHARED_LOAD)
+    if args.add is None and args.remove is None:
+        calculate_load_models(profile=SHARED_LOAD)
+
+    for model, metric, decay_days, impact_days in stored_models(connect()):
+        print(f'{model}: {metric}, decay {decay_days:g} days, impact {impact_days:g} days')
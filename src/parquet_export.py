@@ -0,0 +1,168 @@
+import os
+import json
+import argparse
+import datetime
+from db_connection import DEFAULT_PROFILE, connect
+from populate_from_json import REAL, INTEGER, BOOLEAN, TYPE, DB_COL, AGGREGATION_METHOD, MEAN, \
+    calendar_columns, day_map, workout_map, calculated_map, physiological_map, load_generation
+from instrumentation import report
+
+# pyarrow is only needed to export, the loader runs without it
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PYARROW_MISSING = 'Parquet export needs pyarrow, pip install pyarrow'
+EXPORT_STATE = '_export.json'
+
+
+# Writes the period tables as Parquet in export_directory/period=<period>/activity=<activity>/<year>.parquet, the
+# hive layout pyarrow.dataset, DuckDB and Spark read as partitions. Each file holds the rows of one year from
+# every activity type and equipment table of its period and activity, with activity_type and equipment columns.
+# Parquet files cannot be appended to, so an export after an incremental load rewrites the files of the years
+# from the load's changed_since on, usually just the current year's. _export.json records the load generation
+# exported. An export that is already at the warehouse's generation does nothing and one that has missed a load
+# rewrites everything
+def export_warehouse(export_directory, since=None, profile=DEFAULT_PROFILE):
+    if pa is None:
+        raise ImportError(PYARROW_MISSING)
+
+    conn = connect(profile)
+    generation = load_generation(conn)
+    exported = exported_generation(export_directory)
+    if exported == generation:
+        print(f'Parquet export is at generation {generation} already')
+        conn.close()
+        return
+    if exported != generation - 1:
+        since = None
+    first_year = None if since is None else since.year
+
+    sql_str = 'SELECT period, activity, activity_type, equipment, table_name FROM Tables ORDER BY id'
+    partitions = dict()
+    for period, activity, activity_type, equipment, table_name in conn.cursor().execute(sql_str):
+        partitions.setdefault((period, activity), []).append((activity_type, equipment, table_name))
+
+    written = set()
+    for (period, activity), tables in partitions.items():
+        directory = os.path.join(export_directory, f'period={period}', f'activity={activity}')
+        with report.table(f'{period}/{activity}'):
+            table = partition_table(conn, tables, first_year)
+            report.count(table.num_rows, len(tables), f'{period}/{activity}')
+            written.update(write_years(directory, table))
+
+    for path in part_files(export_directory):
+        if path not in written and (first_year is None or file_year(path) >= first_year):
+            os.remove(path)
+    save_exported_generation(export_directory, generation)
+    conn.close()
+
+
+# the rows of a partition's tables from first_year on, table by table in catalog order and each in date order
+def partition_table(conn, tables, first_year):
+    columns = export_columns()
+    schema = export_schema()
+    parts = []
+    for activity_type, equipment, table_name in tables:
+        sql_str = f'SELECT {", ".join(columns)} FROM {table_name}'
+        parameters = []
+        if first_year is not None:
+            sql_str += ' WHERE date >= ?'
+            parameters.append(f'{first_year}-01-01')
+        rows = conn.cursor().execute(sql_str + ' ORDER BY date', parameters).fetchall()
+        values = list(zip(*rows)) if len(rows) > 0 else [()] * len(columns)
+        arrays = [pa.array([activity_type] * len(rows), pa.string()), pa.array([equipment] * len(rows), pa.string())]
+        for c, column_values in zip(columns, values):
+            arrays.append(column_array(column_values, schema.field(c).type))
+        parts.append(pa.Table.from_arrays(arrays, schema=schema))
+    return pa.concat_tables(parts)
+
+
+def write_years(directory, table):
+    written = []
+    if table.num_rows == 0:
+        return written
+    os.makedirs(directory, exist_ok=True)
+    years = pc.year(table['date'])
+    for year in pc.unique(years).to_pylist():
+        path = os.path.join(directory, f'{year}.parquet')
+        building = f'{path}.building'
+        pq.write_table(table.filter(pc.equal(years, year)), building)
+        os.replace(building, path)
+        written.append(path)
+    return written
+
+
+def export_columns():
+    return ['date'] + calendar_columns + [m[DB_COL] for m in day_map + workout_map + calculated_map +
+                                          physiological_map]
+
+
+# Columns are typed from the maps. Every period has the same schema so the whole export reads as one dataset:
+# rollups average the MEAN columns and count the BOOLEAN ones so those are float64 and int64 throughout.
+# Physiologicals are interpolated between measurements so they are float64 whatever their SQLite type
+def export_schema():
+    fields = [pa.field('activity_type', pa.string()), pa.field('equipment', pa.string()),
+              pa.field('date', pa.date32())]
+    fields += [pa.field(c, pa.string()) for c in calendar_columns]
+    for m in day_map + workout_map + calculated_map:
+        if m[TYPE] == REAL or m.get(AGGREGATION_METHOD) == MEAN:
+            column_type = pa.float64()
+        elif m[TYPE] in [INTEGER, BOOLEAN]:
+            column_type = pa.int64()
+        else:
+            column_type = pa.string()
+        fields.append(pa.field(m[DB_COL], column_type))
+    fields += [pa.field(m[DB_COL], pa.float64()) for m in physiological_map]
+    return pa.schema(fields)
+
+
+# values are converted as they come from SQLite then cast, so a value that does not fit its column raises rather
+# than being truncated
+def column_array(values, column_type):
+    if pa.types.is_string(column_type):
+        return pa.array(values, pa.string())
+    if pa.types.is_date32(column_type):
+        return pa.array(values, pa.string()).cast(column_type)
+    return pa.array(values).cast(column_type)
+
+
+def part_files(export_directory):
+    paths = []
+    for directory, _, files in os.walk(export_directory):
+        paths += [os.path.join(directory, f) for f in files if f.endswith('.parquet')]
+    return paths
+
+
+def file_year(path):
+    return int(os.path.basename(path).split('.')[0])
+
+
+def exported_generation(export_directory):
+    path = os.path.join(export_directory, EXPORT_STATE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['generation']
+
+
+def save_exported_generation(export_directory, generation):
+    os.makedirs(export_directory, exist_ok=True)
+    with open(os.path.join(export_directory, EXPORT_STATE), 'w') as f:
+        json.dump({'generation': generation, 'exported': datetime.datetime.now().isoformat(timespec='seconds')}, f)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('directory')
+    arg_parser.add_argument('--since', type=datetime.date.fromisoformat,
+                            help='rewrite the years from this date on, YYYY-MM-DD, rather than the whole export')
+    args = arg_parser.parse_args()
+    if pa is None:
+        arg_parser.error(PYARROW_MISSING)
+
+    with report.stage('parquet export'):
+        export_warehouse(args.directory, args.since)
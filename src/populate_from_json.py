@@ -1,11 +1,23 @@
 import json
+import hashlib
+import argparse
 import datetime
+import itertools
+from collections import deque
 from datetime import date
 from dateutil import parser
-import sqlite3
 import numpy as np
 import pandas as pd
-import math
+from scipy.signal import lfilter
+from concurrent.futures import ProcessPoolExecutor
+from diary_reader import iter_days, iter_weights, iter_physiologicals
+from sql_writer import BatchWriter
+import db_connection
+from db_connection import DEFAULT_PROFILE, BULK_LOAD, SHARED_LOAD, MEMORY, load_profiles, connect, start_build, \
+    finish_build
+from rolling_stats import RollingWindow
+from instrumentation import report
+from run_ledger import ledger
 
 JSON = 'json'
 DB_COL = 'db_col'
@@ -46,8 +58,7 @@ workout_map = [{JSON: 'km', DB_COL: 'km', TYPE: REAL, FACTOR: 1.0, DEFAULT: 0.0,
                {JSON: 'mph', DB_COL: 'mph', TYPE: REAL, DEFAULT: 0.0, AGGREGATION_METHOD: MEAN, MAPPER: 'mph_mapper'},
                {JSON: 'kph', DB_COL: 'kph', TYPE: REAL, DEFAULT: 0.0, AGGREGATION_METHOD: MEAN, MAPPER: 'kph_mapper'}]
 
-workout_col_names = ','.join([m[DB_COL] for m in workout_map])
-workout_zeroes = ','.join(['0' for _ in workout_map])
+workout_columns = [m[DB_COL] for m in workout_map]
 workout_col_creation = ','.join(f'{m[DB_COL]} {m[TYPE]} DEFAULT {m[DEFAULT]}' for m in workout_map)
 
 day_map = [{JSON: 'fatigue', DB_COL: 'fatigue', TYPE: REAL, FACTOR: 1.0, DEFAULT: 0, AGGREGATION_METHOD: MEAN},
@@ -58,7 +69,7 @@ day_map = [{JSON: 'fatigue', DB_COL: 'fatigue', TYPE: REAL, FACTOR: 1.0, DEFAULT
            {JSON: 'type', DB_COL: 'type', TYPE: 'VARCHAR(32)', FACTOR: 1.0, DEFAULT: "Normal"},
            {JSON: 'sleepQuality', DB_COL: 'sleep_quality', TYPE: 'VARCHAR(32)', FACTOR: 1.0, DEFAULT: 'Average'}]
 
-day_col_names = ','.join(m[DB_COL] for m in day_map)
+day_columns = [m[DB_COL] for m in day_map]
 day_col_creation = ','.join(f"{m[DB_COL]} {m[TYPE]} DEFAULT {m[DEFAULT]}" for m in day_map)
 
 calculated_map = [{DB_COL: 'ctl', TYPE: REAL, DEFAULT: 0.0, AGGREGATION_METHOD: MEAN},
@@ -73,6 +84,7 @@ calculated_map = [{DB_COL: 'ctl', TYPE: REAL, DEFAULT: 0.0, AGGREGATION_METHOD:
                   {DB_COL: 'rpe_strain', TYPE: REAL, DEFAULT: 0.0, AGGREGATION_METHOD: MEAN},
                   ]
 
+calculated_columns = [m[DB_COL] for m in calculated_map]
 calculated_col_creation = ','.join(f"{m[DB_COL]} {m[TYPE]} DEFAULT {m[DEFAULT]}" for m in calculated_map)
 
 physiological_map = [{DB_COL: 'kg', TYPE: REAL},
@@ -83,8 +95,12 @@ physiological_map = [{DB_COL: 'kg', TYPE: REAL},
                   {DB_COL: 'rmssd', TYPE: REAL},
                   ]
 
+physiological_columns = [m[DB_COL] for m in physiological_map]
 physiological_col_creation = ','.join(f"{m[DB_COL]} {m[TYPE]}" for m in physiological_map)
 
+calendar_columns = ['year_week', 'year_month', 'day_of_week', 'month', 'day_type']
+calendar_col_creation = 'year_week VARCHAR(16), year_month VARCHAR(16), day_of_week VARCHAR(8), month VARCHAR(8), day_type VARCHAR(16)'
+
 ACTIVITY = 'activityString'
 ACTIVITY_TYPE = 'activityTypeString'
 EQUIPMENT = 'equipmentName'
@@ -98,226 +114,665 @@ CTL_DECAY = np.exp(-1 / CTL_DECAY_DAYS)
 CTL_IMPACT = 1 - np.exp(-1 / CTL_IMPACT_DAYS)
 ATL_DECAY = np.exp(-1 / ATL_DECAY_DAYS)
 ATL_IMPACT = 1 - np.exp(-1 / ATL_IMPACT_DAYS)
-table_names = set()
 
-DB_NAME = 'training_data_warehouse.sqlite3'
 
-def populate():
+TSB_COLUMNS = ['ctl', 'atl', 'tsb', 'rpe_ctl', 'rpe_atl', 'rpe_tsb']
+STRAIN_COLUMNS = ['monotony', 'strain', 'rpe_monotony', 'rpe_strain']
+STRAIN_WINDOW_DAYS = 7
+
+# TABLE_LAYOUT keeps a wide table per period/activity/type/equipment. FACT_LAYOUT keeps the day rows of every
+# combination in one fact table with the per date columns held once in DAY_INFO and PHYSIOLOGICALS. Each Day_*
+# name is then a view with triggers so it can still be read and written as a table
+TABLE_LAYOUT = 'tables'
+FACT_LAYOUT = 'fact'
+FACT_TABLE = 'DayFacts'
+DAY_INFO = 'DayInfo'
+PHYSIOLOGICALS = 'Physiologicals'
+storage_layout = TABLE_LAYOUT
+
+# Indexes each table of a period gets as (name suffix, columns) on top of the UNIQUE date index. (date, tss,
+# rpe_tss) covers the reads of the TSB and strain stages, year_week and year_month the rollups and (day_type, date)
+# picking out race or rest days. shared_indexes are for the Tables catalog and the fact layout's DAY_INFO
+period_indexes = {DAY: [('date_load', ['date', 'tss', 'rpe_tss']),
+                        ('year_week', ['year_week']),
+                        ('year_month', ['year_month']),
+                        ('day_type', ['day_type', 'date'])],
+                  WEEK: [('year_week', ['year_week'])],
+                  MONTH: [('year_month', ['year_month'])]}
+shared_indexes = {'Tables': [('lookup', ['period', 'activity', 'activity_type', 'equipment', 'table_name'])],
+                  DAY_INFO: [('year_week', ['year_week']),
+                             ('year_month', ['year_month']),
+                             ('day_type', ['day_type', 'date'])]}
+
+# Tables catalog cache of table name -> period. load_catalog reads it from Tables when a stage opens the warehouse
+# and create_table adds to it, so each table is created at most once per process
+table_names = dict()
+
+DIARY_DAYS = 'DiaryDays'
+PHYSIOLOGICAL_DAYS = 'PhysiologicalDays'
+LOAD_STATE = 'LoadState'
+LOAD_GENERATION = 'LoadGeneration'
+DAY_RECORD = 'day'
+WEIGHT_RECORD = 'weight'
+PHYSIOLOGICAL_RECORD = 'physiological'
+
+# with transform_workers > 1 days are sent to the pool in chunks of TRANSFORM_CHUNK_DAYS and each worker has at
+# most CHUNKS_IN_FLIGHT chunks queued or waiting to be written
+TRANSFORM_CHUNK_DAYS = 256
+CHUNKS_IN_FLIGHT = 2
+
+
+# returns the earliest date whose rows changed, or None if nothing changed, and the earliest date a changed weight
+# or physiological record moved the physiological columns on, or None. In incremental mode only days whose content
+# hash differs from the last load are written and everything downstream is left to start there.
+# With transform_workers > 1 days are turned into rows across a process pool while this process writes them.
+# Each stage commits as the ledger records it, and a stage the ledger has as done for a resumed run is skipped
+def populate(incremental=False, layout=None, columnar=False, profile=BULK_LOAD, transform_workers=1):
+    global storage_layout
+
+    conn = connect(profile)
+    create_load_state_table(conn)
+    if layout == FACT_LAYOUT:
+        create_fact_tables(conn)
+    storage_layout = layout_of(conn)
+    load_catalog(conn)
+
+    # The days are staged in a temporary table for the gap fill so they only count as done once it has run. Their
+    # hashes are saved in the same commit as the ledger's record, a run stopped before that loads them again
+    if ledger.is_done('days'):
+        since, min_date, max_date = ledger.since, ledger.min_date, ledger.max_date
+    else:
+        since, min_date, max_date, day_hashes = load_days(conn, incremental, columnar, transform_workers)
+        if since is not None:
+            with report.stage('gap fill'):
+                fill_gaps(conn, since)
+        save_load_state(conn, DAY_RECORD, day_hashes)
+        since = ledger.days_done(conn, since, min_date, max_date)
+
+    # built once the days are in, as sorting each table into its indexes is quicker than growing them row by row
+    with report.stage('indexes'):
+        create_indexes(conn)
+        conn.commit()
+
+    # a resumed run cannot tell what the physiologicals it already loaded changed, so they count as all changed
+    physiologicals_rewritten = min_date
+    if not ledger.is_done('physiologicals'):
+        with report.stage('physiologicals'):
+            weights_since, weight_hashes = changed_records_since(conn, iter_weights(), WEIGHT_RECORD, incremental)
+            weights = kg_fat_percent_frame(iter_weights(), min_date, max_date, since, weights_since)
+            physiologicals_since, physiological_hashes = changed_records_since(conn, iter_physiologicals(),
+                                                                               PHYSIOLOGICAL_RECORD, incremental)
+            physiologicals = hr_sdnn_rmssd_frame(iter_physiologicals(), min_date, max_date, since,
+                                                 physiologicals_since)
+            frame = weights.join(physiologicals, how='outer')
+            populate_physiologicals(conn, frame)
+            # saved with the ledger's record, a run stopped before that writes the changed values again
+            save_load_state(conn, WEIGHT_RECORD, weight_hashes)
+            save_load_state(conn, PHYSIOLOGICAL_RECORD, physiological_hashes)
+            # interpolation reaches back before a changed record, the first date written is where the change starts
+            physiologicals_rewritten = None
+            written = frame.dropna(how='all').index
+            if (weights_since is not None or physiologicals_since is not None) and len(written) > 0:
+                physiologicals_rewritten = written.min().date()
+            ledger.done(conn, 'physiologicals')
 
-    s = datetime.datetime.now()
+    conn.commit()
+    conn.close()
 
-    conn = sqlite3.connect(DB_NAME)
+    return since, physiologicals_rewritten
 
-    f = open('TrainingDiary.json')
-    data = json.load(f)
-    days = data['days']
+
+# writes the changed diary days and stages every day for the gap fill. Returns the earliest changed date, or None,
+# the first and last dates of the diary and the content hash of every day
+def load_days(conn, incremental, columnar, transform_workers):
+    create_diary_days_table(conn)
+    writer = BatchWriter(conn)
 
     min_date = datetime.datetime.now().date()
     max_date = datetime.date(year=1, month=1, day=1)
 
-    for d in days:
-        date_time = parser.parse(d['iso8061DateString'])
-        d_date = date(date_time.year, date_time.month, date_time.day)
-        min_date = min(min_date, d_date)
-        max_date = max(max_date, d_date)
+    previous_hashes = dict()
+    if incremental:
+        previous_hashes = load_state(conn, DAY_RECORD)
+    day_hashes = dict()
+    columnar_days = []
+    changed_count = 0
+    since = None
+    if not incremental:
+        since = clear_days(conn)
+
+    with report.stage('days') as stage:
+        days = report.timed(iter_days(), 'parse diary')
+        if transform_workers > 1:
+            transformed_days = pipelined_days(days, previous_hashes, transform_workers)
+        else:
+            transformed_days = (transform_day(d, previous_hashes, columnar) for d in days)
 
-        d_values = value_string_for_sql(d, day_map)
+        for d_date, d_hash, changed, transformed in transformed_days:
+            min_date = min(min_date, d_date)
+            max_date = max(max_date, d_date)
 
-        if 'workouts' in d:
-            save_workouts(conn, d_date, d['type'], d_values, d['workouts'])
-        else:
-            execute_day_sql(conn, d_date, d['type'], day_col_names, d_values,
-                            activity='All', activity_type='All', equipment_name='All')
-
-    #    fill in gaps
-        for t in table_names:
-            if not day_exists(d_date, t, conn):
-                execute_day_sql(conn, d_date, d['type'], day_col_names, d_values, table_name=t)
-
-    print(f'Days on in {datetime.datetime.now() - s}')
-    s = datetime.datetime.now()
-    print('starting kg and fat%')
-    populate_kg_fat_percent(conn, data, min_date, max_date)
-    print(f'Done in {datetime.datetime.now() - s}')
-    s = datetime.datetime.now()
-    print('starting hr and HRV')
-    populate_hr_sdnn_rmssd(conn, data, min_date, max_date)
-    print(f'Done in {datetime.datetime.now() - s}')
+            day_hashes[str(d_date)] = d_hash
+            if not changed:
+                write_day_rows(writer, transformed)
+                continue
+
+            changed_count += 1
+            if since is None or d_date < since:
+                since = d_date
+
+            if incremental:
+                delete_day(conn, d_date)
+
+            if columnar:
+                columnar_days.append(transformed)
+            else:
+                write_day_rows(writer, transformed)
+
+        removed_days = [date.fromisoformat(d) for d in previous_hashes if d not in day_hashes]
+        for d_date in removed_days:
+            delete_day(conn, d_date)
+            if since is None or d_date < since:
+                since = d_date
+
+        if len(columnar_days) > 0:
+            save_days_columnar(writer, columnar_days)
+        writer.flush()
+
+        stage['changed'] = changed_count
+        stage['removed'] = len(removed_days)
+        print(f'{changed_count} changed, {len(removed_days)} removed')
+
+    return since, min_date, max_date, day_hashes
+
+
+def create_load_state_table(conn):
+    sql_str = f'''
+        CREATE TABLE IF NOT EXISTS {LOAD_STATE}
+        (record_type VARCHAR(32),
+        date DATE,
+        hash VARCHAR(40),
+        PRIMARY KEY (record_type, date))
+    '''
+    conn.cursor().execute(sql_str)
 
+
+def create_load_generation_table(conn):
+    sql_str = f'''
+        CREATE TABLE IF NOT EXISTS {LOAD_GENERATION}
+        (id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER,
+        loaded TIMESTAMP)
+    '''
+    conn.cursor().execute(sql_str)
+
+
+# One row counting the loads that changed the warehouse. warehouse_query drops its cached results when it moves on.
+# A resumed run moves it on once
+def advance_generation(profile=BULK_LOAD):
+    if ledger.is_done('generation'):
+        return
+    conn = connect(profile)
+    create_load_generation_table(conn)
+    sql_str = f'''
+        INSERT INTO {LOAD_GENERATION} (id, generation, loaded) VALUES (1, 1, ?)
+        ON CONFLICT(id) DO UPDATE SET generation=generation + 1, loaded=excluded.loaded
+    '''
+    conn.cursor().execute(sql_str, (datetime.datetime.now().isoformat(timespec='seconds'),))
+    ledger.done(conn, 'generation')
     conn.commit()
     conn.close()
 
 
-def populate_kg_fat_percent(conn, data, min_date, max_date):
+# 0 for a warehouse loaded before generations were counted
+def load_generation(conn):
+    sql_str = f'SELECT name FROM sqlite_master WHERE type="table" AND name="{LOAD_GENERATION}"'
+    if conn.cursor().execute(sql_str).fetchone() is None:
+        return 0
+    row = conn.cursor().execute(f'SELECT generation FROM {LOAD_GENERATION}').fetchone()
+    if row is None:
+        return 0
+    return row[0]
+
+
+def record_hash(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# date of an iso8061DateString as written, ignoring any time and offset. The diary writes 2015-01-01T00:00:00Z so
+# the date is read straight from the first ten characters. Anything else is left to dateutil
+def diary_date(iso_string):
+    if len(iso_string) == 10 or (len(iso_string) > 10 and iso_string[10] in 'T '):
+        try:
+            return date.fromisoformat(iso_string[:10])
+        except ValueError:
+            pass
+    date_time = parser.parse(iso_string)
+    return date(date_time.year, date_time.month, date_time.day)
+
+
+def load_state(conn, record_type):
+    sql_str = f'SELECT date, hash FROM {LOAD_STATE} WHERE record_type="{record_type}"'
+    results = conn.cursor().execute(sql_str)
+    return {r[0]: r[1] for r in results}
+
+
+def save_load_state(conn, record_type, hashes):
+    conn.cursor().execute(f'DELETE FROM {LOAD_STATE} WHERE record_type="{record_type}"')
+    conn.cursor().executemany(f'INSERT INTO {LOAD_STATE} (record_type, date, hash) VALUES (?, ?, ?)',
+                              [(record_type, d, h) for d, h in hashes.items()])
+
+
+# weights and physiologicals are hashed per date. Returns the earliest date with a changed record or None, and the
+# hashes to save once the changed values have been written
+def changed_records_since(conn, records, record_type, incremental):
+    grouped = dict()
+    for r in records:
+        d_date = diary_date(r['iso8061DateString'])
+        grouped.setdefault(str(d_date), []).append(r)
+
+    hashes = {d: record_hash(r) for d, r in grouped.items()}
+    previous_hashes = dict()
+    if incremental:
+        previous_hashes = load_state(conn, record_type)
+
+    changed = [d for d, h in hashes.items() if previous_hashes.get(d) != h]
+    changed += [d for d in previous_hashes if d not in hashes]
+    if len(changed) == 0:
+        return None, hashes
+    return date.fromisoformat(min(changed)), hashes
+
+
+# first date of an interpolated series that needs writing. Interpolation reaches back to the last measurement
+# before a changed record so everything from there may move. Returns None if the series needs no update
+def series_update_start(measurement_dates, days_since, records_since):
+    starts = []
+    if days_since is not None:
+        starts.append(days_since)
+    if records_since is not None:
+        earlier = [d for d in measurement_dates if d < records_since]
+        if len(earlier) > 0:
+            starts.append(max(earlier))
+        else:
+            starts.append(records_since)
+    if len(starts) == 0:
+        return None
+    return min(starts)
+
+
+def delete_day(conn, d_date):
+    if storage_layout == FACT_LAYOUT:
+        for t in [FACT_TABLE, DAY_INFO, PHYSIOLOGICALS]:
+            conn.cursor().execute(f'DELETE FROM {t} WHERE date="{d_date}"')
+        return
+    for t in table_list(conn, period=DAY):
+        conn.cursor().execute(f'DELETE FROM {t} WHERE date="{d_date}"')
+
+
+# A load that is not incremental writes every day again, so it empties the Day tables first rather than leaving
+# the rows of changed days in place. Returns the earliest date they held, or None, as everything from there on
+# has to be recalculated even where the diary no longer has the day
+def clear_days(conn):
+    tables = table_list(conn, period=DAY)
+    if storage_layout == FACT_LAYOUT:
+        tables = [FACT_TABLE, DAY_INFO, PHYSIOLOGICALS]
+    first = None
+    for t in tables:
+        low = conn.cursor().execute(f'SELECT MIN(date) FROM {t}').fetchone()[0]
+        if low is not None and (first is None or low < first):
+            first = low
+        conn.cursor().execute(f'DELETE FROM {t}')
+    return None if first is None else date.fromisoformat(first)
+
+
+# every diary day is staged here so gaps can be filled with one statement per table once they are all written
+def create_diary_days_table(conn):
+    sql_str = f'''
+        CREATE TEMP TABLE IF NOT EXISTS {DIARY_DAYS}
+        (date DATE PRIMARY KEY,
+        {calendar_col_creation},
+        {day_col_creation})
+    '''
+    conn.cursor().execute(sql_str)
+
+
+# gives every Day_* table a row with the day values and zero workout values for each staged day it has no row
+# for. A table only gets filler rows from its first real row onwards. With since only days from since on are
+# filled, gaps can only open up on changed days and in tables first written to by them
+def fill_gaps(conn, since=None):
+    columns = ['date'] + calendar_columns + day_columns
+    since_str = '' if since is None else 'AND d.date >= ?'
+    parameters = [] if since is None else [str(since)]
+    for t in table_list(conn, period=DAY):
+        sql_str = f'''
+            INSERT OR IGNORE INTO {t}
+            ({', '.join(columns)})
+            SELECT {', '.join(f'd.{c}' for c in columns)}
+            FROM {DIARY_DAYS} d
+            LEFT JOIN {t} existing ON existing.date = d.date
+            WHERE existing.date IS NULL AND d.date >= (SELECT MIN(date) FROM {t}) {since_str}
+            ORDER BY d.date
+        '''
+        with report.table(t):
+            cursor = conn.cursor()
+            cursor.execute(sql_str, parameters)
+            report.count(cursor.rowcount, table_name=t)
+    conn.commit()
+
+
+# interpolated kg, lbs and fat_percentage for every date from min_date to max_date, or for the dates an incremental
+# run has to rewrite. Dates before the first measurement are 0 and a column that needs no update is NaN
+def kg_fat_percent_frame(weights, min_date, max_date, days_since=None, records_since=None):
     kg_dates = []
     kg_array = []
     fat_dates = []
     fat_percent = []
-    if 'weights' in data:
-        for d in data['weights']:
-            date_time = parser.parse(d['iso8061DateString'])
-            d_date = date(date_time.year, date_time.month, date_time.day)
-            kg = round(float(d['kg']), 1)
-            fat = round(float(d['fatPercent']), 1)
-            if kg > 0:
-                kg_dates.append(d_date)
-                kg_array.append(kg)
-            if fat > 0:
-                fat_dates.append(d_date)
-                fat_percent.append(fat)
-    kg_series = pd.Series(kg_array, index=pd.to_datetime(kg_dates))
-    kg_series = kg_series.reindex(index=pd.date_range(min_date, max_date)).interpolate(method='linear')
-    fat_series = pd.Series(fat_percent, index=pd.to_datetime(fat_dates))
-    fat_series = fat_series.reindex(index=pd.date_range(min_date, max_date)).interpolate(method='linear')
-
-    for table in table_list(conn):
-        for d, value in kg_series.iteritems():
-            if math.isnan(value):
-                value = 0
-            lbs = round(value * 2.20462, 1)
-            sql_str = f'UPDATE {table} SET kg={round(value,1)}, lbs={lbs} WHERE date="{str(d.date())}"'
-            conn.cursor().execute(sql_str)
-        for d, value in fat_series.iteritems():
-            if math.isnan(value):
-                value = 0
-            sql_str = f'UPDATE {table} SET fat_percentage={round(value,1)} WHERE date="{str(d.date())}"'
-            conn.cursor().execute(sql_str)
-
-
-def populate_hr_sdnn_rmssd(conn, data, min_date, max_date):
+    for d in weights:
+        d_date = diary_date(d['iso8061DateString'])
+        kg = round(float(d['kg']), 1)
+        fat = round(float(d['fatPercent']), 1)
+        if kg > 0:
+            kg_dates.append(d_date)
+            kg_array.append(kg)
+        if fat > 0:
+            fat_dates.append(d_date)
+            fat_percent.append(fat)
+    kg_series = interpolated_series(kg_array, kg_dates, min_date, max_date)
+    fat_series = interpolated_series(fat_percent, fat_dates, min_date, max_date)
+
+    if days_since is not None or records_since is not None:
+        kg_series = series_since(kg_series, series_update_start(kg_dates, days_since, records_since))
+        fat_series = series_since(fat_series, series_update_start(fat_dates, days_since, records_since))
+
+    return pd.DataFrame({'kg': round_half_even(kg_series.to_numpy(), 1),
+                         'lbs': round_half_even(kg_series.to_numpy() * 2.20462, 1)},
+                        index=kg_series.index).join(
+        pd.DataFrame({'fat_percentage': round_half_even(fat_series.to_numpy(), 1)}, index=fat_series.index),
+        how='outer')
+
+
+def interpolated_series(values, dates, min_date, max_date):
+    series = pd.Series(values, index=pd.to_datetime(dates), dtype=float)
+    series = series.reindex(index=pd.date_range(min_date, max_date)).interpolate(method='linear')
+    return series.fillna(0)
+
+
+def series_since(series, start):
+    if start is None:
+        return series.iloc[0:0]
+    return series[series.index >= pd.Timestamp(start)]
+
+
+# resting_hr, sdnn and rmssd in the same form as kg_fat_percent_frame
+def hr_sdnn_rmssd_frame(physiologicals, min_date, max_date, days_since=None, records_since=None):
     hr_dates = []
     hr_array = []
     sdnn_dates = []
     sdnn_array = []
     rmssd_dates = []
     rmssd_array = []
-    if 'physiologicals' in data:
-        for d in data['physiologicals']:
-            date_time = parser.parse(d['iso8061DateString'])
-            d_date = date(date_time.year, date_time.month, date_time.day)
-            hr = sdnn = rmssd = 0
-            if d['restingHR'] is not None:
-                hr = int(d['restingHR'])
-            if d['restingSDNN'] is not None:
-                sdnn = round(float(d['restingSDNN']), 1)
-            if d['restingRMSSD'] is not None:
-                rmssd = round(float(d['restingRMSSD']), 1)
-            if hr > 0:
-                hr_dates.append(d_date)
-                hr_array.append(hr)
-            if sdnn > 0:
-                sdnn_dates.append(d_date)
-                sdnn_array.append(sdnn)
-            if rmssd > 0:
-                rmssd_dates.append(d_date)
-                rmssd_array.append(sdnn)
-    hr_series = pd.Series(hr_array, index=pd.to_datetime(hr_dates))
-    hr_series = hr_series.reindex(index=pd.date_range(min_date, max_date)).interpolate(method='linear')
-    sdnn_series = pd.Series(sdnn_array, index=pd.to_datetime(sdnn_dates))
-    sdnn_series = sdnn_series.reindex(index=pd.date_range(min_date, max_date)).interpolate(method='linear')
-    rmssd_series = pd.Series(sdnn_array, index=pd.to_datetime(rmssd_dates))
-    rmssd_series = rmssd_series.reindex(index=pd.date_range(min_date, max_date)).interpolate(method='linear')
-
-    for table in table_list(conn):
-        for d, value in hr_series.iteritems():
-            if value is None or math.isnan(value):
-                value = 0
-            sql_str = f'UPDATE {table} SET resting_hr={value} WHERE date="{str(d.date())}"'
-            conn.cursor().execute(sql_str)
-        for d, value in sdnn_series.iteritems():
-            if value is None or math.isnan(value):
-                value = 0
-            sql_str = f'UPDATE {table} SET sdnn={round(value,1)} WHERE date="{str(d.date())}"'
-            conn.cursor().execute(sql_str)
-        for d, value in rmssd_series.iteritems():
-            if value is None or math.isnan(value):
-                value = 0
-            sql_str = f'UPDATE {table} SET rmssd={round(value,1)} WHERE date="{str(d.date())}"'
-            conn.cursor().execute(sql_str)
-
-
-
-def table_list(conn):
+    for d in physiologicals:
+        d_date = diary_date(d['iso8061DateString'])
+        hr = sdnn = rmssd = 0
+        if d['restingHR'] is not None:
+            hr = int(d['restingHR'])
+        if d['restingSDNN'] is not None:
+            sdnn = round(float(d['restingSDNN']), 1)
+        if d['restingRMSSD'] is not None:
+            rmssd = round(float(d['restingRMSSD']), 1)
+        if hr > 0:
+            hr_dates.append(d_date)
+            hr_array.append(hr)
+        if sdnn > 0:
+            sdnn_dates.append(d_date)
+            sdnn_array.append(sdnn)
+        if rmssd > 0:
+            rmssd_dates.append(d_date)
+            rmssd_array.append(rmssd)
+    hr_series = interpolated_series(hr_array, hr_dates, min_date, max_date)
+    sdnn_series = interpolated_series(sdnn_array, sdnn_dates, min_date, max_date)
+    rmssd_series = interpolated_series(rmssd_array, rmssd_dates, min_date, max_date)
+
+    if days_since is not None or records_since is not None:
+        hr_series = series_since(hr_series, series_update_start(hr_dates, days_since, records_since))
+        sdnn_series = series_since(sdnn_series, series_update_start(sdnn_dates, days_since, records_since))
+        rmssd_series = series_since(rmssd_series, series_update_start(rmssd_dates, days_since, records_since))
+
+    frames = [pd.DataFrame({'resting_hr': hr_series}),
+              pd.DataFrame({'sdnn': round_half_even(sdnn_series.to_numpy(), 1)}, index=sdnn_series.index),
+              pd.DataFrame({'rmssd': round_half_even(rmssd_series.to_numpy(), 1)}, index=rmssd_series.index)]
+    return frames[0].join(frames[1:], how='outer')
+
+
+# Stages the per date physiological frame once and copies it into every physiological table with one
+# UPDATE ... FROM each. A NaN in the frame leaves the value already in the table alone
+def populate_physiologicals(conn, frame):
+    frame = frame.reindex(columns=physiological_columns).dropna(how='all')
+    conn.cursor().execute(f'DROP TABLE IF EXISTS temp.{PHYSIOLOGICAL_DAYS}')
+    sql_str = f'''
+        CREATE TEMP TABLE {PHYSIOLOGICAL_DAYS}
+        (date DATE PRIMARY KEY,
+        {physiological_col_creation})
+    '''
+    conn.cursor().execute(sql_str)
+    dates = [str(d.date()) for d in frame.index]
+    with BatchWriter(conn) as writer:
+        writer.insert_many(PHYSIOLOGICAL_DAYS, ['date'] + physiological_columns,
+                           [(d,) + tuple(values) for d, values in zip(dates, frame.itertuples(index=False))])
+
+    with conn:
+        for table in physiological_tables(conn):
+            sql_str = f'''
+                UPDATE {table} SET
+                {', '.join(f'{c} = COALESCE(p.{c}, {table}.{c})' for c in physiological_columns)}
+                FROM {PHYSIOLOGICAL_DAYS} p
+                WHERE {table}.date = p.date
+            '''
+            with report.table(table):
+                cursor = conn.cursor()
+                cursor.execute(sql_str)
+                report.count(cursor.rowcount, table_name=table)
+
+
+# In the fact layout the Day_* views share one row of physiological values per date. Only days hold them, the
+# week and month rollups do not aggregate them so an update there would leave point values a rebuild drops
+def physiological_tables(conn):
+    if storage_layout == FACT_LAYOUT:
+        return [PHYSIOLOGICALS]
+    return table_list(conn, period=DAY)
+
+
+def table_list(conn, period=None):
     sql_str = f'SELECT table_name FROM Tables'
+    if period is not None:
+        sql_str = f'SELECT table_name FROM Tables WHERE period="{period}"'
     results = conn.cursor().execute(sql_str)
     return [r[0] for r in results]
 
 
-def calculate_all_tsb():
-    conn = sqlite3.connect(DB_NAME)
-
-    for r in table_list(conn):
-        calculate_tsb(conn, r)
+def calculate_all_tsb(since=None, workers=1, profile=BULK_LOAD):
+    with report.stage('tsb'):
+        calculate_all_derived('tsb', tsb_rows, TSB_COLUMNS, since, workers, profile)
+
+
+def calculate_all_strain(since=None, workers=1, profile=BULK_LOAD):
+    with report.stage('strain'):
+        calculate_all_derived('strain', monotony_strain_rows, STRAIN_COLUMNS, since, workers, profile)
+
+
+# Tables are independent so with workers > 1 they are read and calculated across a process pool. All results
+# come back to this process so there is only ever one connection writing to the database. Each table is committed
+# as the ledger records it under stage_name and the tables it has as done for a resumed run are skipped
+def calculate_all_derived(stage_name, rows_function, columns, since=None, workers=1, profile=BULK_LOAD):
+    # the workers read while this connection writes so it cannot hold the file exclusively
+    if workers > 1 and profile == BULK_LOAD:
+        profile = SHARED_LOAD
+    conn = connect(profile)
+    tables = [t for t in table_list(conn, period=DAY) if not ledger.is_done(stage_name, t)]
+
+    with BatchWriter(conn) as writer:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=open_worker_connection,
+                                     initargs=(profile, db_connection.database)) as pool:
+                n = len(tables)
+                results = pool.map(worker_rows, [rows_function] * n, tables, [since] * n)
+                for table_name, rows in zip(tables, results):
+                    with report.table(table_name) as entry:
+                        write_derived(writer, table_name, columns, rows)
+                        ledger.done(conn, stage_name, table_name, writer)
+                        entry['rows'] += len(rows)
+        else:
+            for table_name in tables:
+                with report.table(table_name) as entry:
+                    rows = rows_function(conn, table_name, since)
+                    write_derived(writer, table_name, columns, rows)
+                    ledger.done(conn, stage_name, table_name, writer)
+                    entry['rows'] += len(rows)
 
     conn.commit()
+    conn.close()
 
 
-def calculate_tsb(conn, table_name):
-    sql_str = f'SELECT id, tss, rpe_tss FROM {table_name} ORDER BY date'
-    atl = ctl = rpe_atl = rpe_ctl = 0.0
+worker_conn = None
 
-    results = conn.cursor().execute(sql_str)
-    for r in results:
-        id = r[0]
-        tss = r[1]
-        rpe_tss = r[2]
-        ctl = tss * CTL_IMPACT + ctl * CTL_DECAY
-        atl = tss * ATL_IMPACT + atl * ATL_DECAY
-        tsb = ctl - atl
-        rpe_ctl = rpe_tss * CTL_IMPACT + rpe_ctl * CTL_DECAY
-        rpe_atl = rpe_tss * ATL_IMPACT + rpe_atl * ATL_DECAY
-        rpe_tsb = rpe_ctl - rpe_atl
-        sql_str = f'''
-            UPDATE {table_name} SET 
-            ctl={ctl}, atl={atl}, tsb={tsb}, rpe_ctl={rpe_ctl}, rpe_atl={rpe_atl}, rpe_tsb={rpe_tsb} 
-            WHERE id={id}'''
-        conn.cursor().execute(sql_str)
 
-def calculate_all_strain():
-    conn = sqlite3.connect(DB_NAME)
+def open_worker_connection(profile=DEFAULT_PROFILE, db_name=None):
+    global worker_conn
+    worker_conn = connect(profile, db_name)
 
-    for r in table_list(conn):
-        calculate_monotony_strain(conn, r)
 
-    conn.commit()
+def worker_rows(rows_function, table_name, since):
+    return rows_function(worker_conn, table_name, since)
 
 
-def calculate_monotony_strain(conn, table_name):
-    df = pd.read_sql(f'SELECT id, date, tss, rpe_tss from {table_name} ORDER BY date', conn)
-    df['tss_stdev'] = df['tss'].rolling(7, min_periods=0).std().clip(lower=0.01)
-    df['rpe_tss_stdev'] = df['rpe_tss'].rolling(7, min_periods=0).std().clip(lower=0.01)
-    df['monotony'] = df['tss'].rolling(7, min_periods=1).mean() / df['tss_stdev']
-    df['strain'] = df['tss'].rolling(7, min_periods=1).sum() * df['monotony']
-    df['rpe_monotony'] = df['rpe_tss'].rolling(7, min_periods=1).mean() / df['rpe_tss_stdev']
-    df['rpe_strain'] = df['rpe_tss'].rolling(7, min_periods=1).sum() * df['rpe_monotony']
-    df.fillna(0, inplace=True)
+def write_derived(writer, table_name, columns, rows):
+    for row in rows:
+        writer.update(table_name, columns, ['id'], row)
 
-    for index, row in df.iterrows():
-        sql_str = f'''
-            UPDATE {table_name} SET
-            monotony={row['monotony']}, strain={row['strain']}, 
-            rpe_monotony={row['rpe_monotony']}, rpe_strain={row['rpe_strain']}
-            WHERE id={row['id']}
-        '''
-        conn.cursor().execute(sql_str)
 
+def calculate_tsb(conn, table_name, since=None):
+    with BatchWriter(conn) as writer:
+        write_derived(writer, table_name, TSB_COLUMNS, tsb_rows(conn, table_name, since))
 
-def create_and_populate_agg_tables(period):
-    agg_str, insert_str = create_agg_and_insert_str_for_sql()
-    conn = sqlite3.connect(DB_NAME)
-    sql_str = f'SELECT activity, activity_type, equipment FROM Tables WHERE period="{DAY}"'
-    tables = conn.cursor().execute(sql_str)
 
-    for t in tables:
-        create_and_populate_agg_table(conn, period, t[0], t[1], t[2], agg_str, insert_str)
+# rows of TSB_COLUMNS values followed by the id. With since set the recursion is carried on from the values of
+# the last row before that date
+def tsb_rows(conn, table_name, since=None):
+    sql_str = f'SELECT id, tss, rpe_tss FROM {table_name} ORDER BY date'
+    atl = ctl = rpe_atl = rpe_ctl = 0.0
 
-    conn.commit()
+    if since is not None:
+        seed_str = f'SELECT ctl, atl, rpe_ctl, rpe_atl FROM {table_name} WHERE date<"{since}" ORDER BY date DESC LIMIT 1'
+        seed = conn.cursor().execute(seed_str).fetchone()
+        if seed is not None:
+            ctl, atl, rpe_ctl, rpe_atl = seed
+        sql_str = f'SELECT id, tss, rpe_tss FROM {table_name} WHERE date>="{since}" ORDER BY date'
+
+    results = conn.cursor().execute(sql_str).fetchall()
+    if len(results) == 0:
+        return []
+    ids, tss, rpe_tss = zip(*results)
+    tss = np.array(tss, dtype=float)
+    rpe_tss = np.array(rpe_tss, dtype=float)
+
+    loads = exponential_loads(np.column_stack([tss, tss, rpe_tss, rpe_tss]),
+                              [CTL_DECAY_DAYS, ATL_DECAY_DAYS] * 2, [CTL_IMPACT_DAYS, ATL_IMPACT_DAYS] * 2,
+                              [ctl, atl, rpe_ctl, rpe_atl])
+    ctl, atl, rpe_ctl, rpe_atl = loads.T
+
+    return list(zip(ctl.tolist(), atl.tolist(), (ctl - atl).tolist(),
+                    rpe_ctl.tolist(), rpe_atl.tolist(), (rpe_ctl - rpe_atl).tolist(), ids))
+
+
+# load[n] = values[n] * impact + load[n-1] * decay for the whole series in one call. It is a first order IIR
+# filter so lfilter runs it in C. initial is the load of the day before values[0]
+def exponential_load(values, impact, decay, initial=0.0):
+    load, _ = lfilter([impact], [1.0, -decay], values, zi=[initial * decay])
+    return load
+
+
+# Loads of many series at once. Column j of values is filtered with the time constants decay_days[j] and
+# impact_days[j] and initial[j] is its load on the day before its first row. Columns sharing a pair of time
+# constants go through one lfilter call together, column by column giving what exponential_load does
+def exponential_loads(values, decay_days, impact_days, initial=None):
+    values = np.asarray(values, dtype=float)
+    decay_days = np.asarray(decay_days, dtype=float)
+    impact_days = np.asarray(impact_days, dtype=float)
+    if initial is None:
+        initial = np.zeros(values.shape[1])
+    initial = np.asarray(initial, dtype=float)
+
+    loads = np.empty_like(values)
+    for d_days, i_days in sorted(set(zip(decay_days.tolist(), impact_days.tolist()))):
+        columns = (decay_days == d_days) & (impact_days == i_days)
+        decay = np.exp(-1 / d_days)
+        impact = 1 - np.exp(-1 / i_days)
+        # filtered as rows so each series is contiguous in memory
+        series, _ = lfilter([impact], [1.0, -decay], np.ascontiguousarray(values[:, columns].T), axis=1,
+                            zi=(initial[columns] * decay)[:, None])
+        loads[:, columns] = series.T
+    return loads
+
+
+def calculate_monotony_strain(conn, table_name, since=None):
+    with BatchWriter(conn) as writer:
+        write_derived(writer, table_name, STRAIN_COLUMNS, monotony_strain_rows(conn, table_name, since))
+
+
+# rows of STRAIN_COLUMNS values followed by the id. With since set only rows from that date are read and returned,
+# the window is seeded with the 6 rows before it so rows already written are left as they are
+def monotony_strain_rows(conn, table_name, since=None):
+    window = RollingWindow(STRAIN_WINDOW_DAYS, 2)
+    sql_str = f'SELECT id, tss, rpe_tss FROM {table_name} ORDER BY date'
+    if since is not None:
+        seed_str = f'SELECT tss, rpe_tss FROM {table_name} WHERE date<"{since}" ORDER BY date DESC LIMIT {STRAIN_WINDOW_DAYS - 1}'
+        seed = conn.cursor().execute(seed_str).fetchall()
+        if len(seed) > 0:
+            window.extend(seed[::-1])
+        sql_str = f'SELECT id, tss, rpe_tss FROM {table_name} WHERE date>="{since}" ORDER BY date'
+
+    results = conn.cursor().execute(sql_str).fetchall()
+    if len(results) == 0:
+        return []
+    ids = [r[0] for r in results]
+    sums, means, stds = window.extend([r[1:] for r in results])
+    monotony = means / np.clip(stds, 0.01, None)
+    strain = sums * monotony
+    values = np.column_stack([monotony[:, 0], strain[:, 0], monotony[:, 1], strain[:, 1]])
+    values[np.isnan(values)] = 0
+
+    return [tuple(r) + (i,) for r, i in zip(values.tolist(), ids)]
+
+
+# Week and month tables are rolled up from their Day_* table in SQL, every table in one transaction unless the
+# ledger is recording a run, when each table is committed as it is recorded. With since set only the periods that
+# held or now hold a day from then on are rebuilt. A rollup row's date is the last date of its period so the
+# periods it held are those of the rows dated since or later
+def create_and_populate_agg_tables(period, profile=BULK_LOAD, since=None):
+    global storage_layout
 
+    agg_str, insert_str = create_agg_and_insert_str_for_sql()
+    conn = connect(profile)
+    storage_layout = layout_of(conn)
+    load_catalog(conn)
+    sql_str = f'SELECT activity, activity_type, equipment FROM Tables WHERE period="{DAY}"'
+    tables = conn.cursor().execute(sql_str).fetchall()
+
+    stage_name = f'{period.lower()} rollup'
+    with report.stage(stage_name), conn:
+        create_indexes(conn)
+        for t in tables:
+            table_name = f'{period}_{t[0]}_{t[1]}_{t[2]}'
+            if ledger.is_done(stage_name, table_name):
+                continue
+            create_and_populate_agg_table(conn, period, t[0], t[1], t[2], agg_str, insert_str, since)
+            ledger.done(conn, stage_name, table_name)
+
+    conn.close()
 
-def create_and_populate_agg_table(conn, period, activity, activity_type, equipment_name, aggregation_str, insert_str):
-    table_name = create_table(period, activity, activity_type, equipment_name, conn)
-    day_table = f'{DAY}_{activity}_{activity_type}_{equipment_name}'
 
+def create_and_populate_agg_table(conn, period, activity, activity_type, equipment_name, aggregation_str, insert_str,
+                                  since=None):
     if period == WEEK:
         agg = 'year_week'
     elif period == MONTH:
@@ -326,40 +781,116 @@ def create_and_populate_agg_table(conn, period, activity, activity_type, equipme
         print(f'{period} unsupported')
         return
 
+    table_name = create_table(period, activity, activity_type, equipment_name, conn)
+    day_table = f'{DAY}_{activity}_{activity_type}_{equipment_name}'
+    create_table_indexes(conn, table_name, period_indexes[period])
+
+    periods = []
+    periods_str = ''
+    if since is None:
+        conn.cursor().execute(f'DELETE FROM {table_name}')
+    else:
+        sql_str = f'SELECT {agg} FROM {table_name} WHERE date>=? UNION SELECT {agg} FROM {day_table} WHERE date>=?'
+        periods = [r[0] for r in conn.cursor().execute(sql_str, (str(since), str(since)))]
+        if len(periods) == 0:
+            return
+        periods_str = f'WHERE {agg} IN ({",".join("?" for _ in periods)})'
+        conn.cursor().execute(f'DELETE FROM {table_name} {periods_str}', periods)
+
     sql_str = f'''
-            SELECT {agg}, {aggregation_str}
-            FROM {day_table}
-            GROUP BY {agg}
+        INSERT INTO {table_name}
+        ({agg}, {insert_str})
+        SELECT {agg}, {aggregation_str}
+        FROM {day_table}
+        {periods_str}
+        GROUP BY {agg}
     '''
-    result = conn.cursor().execute(sql_str)
-    for r in result:
-        sql_str = f'''
-            INSERT INTO {table_name}
-            ({agg}, {insert_str})
-            VALUES
-            {r}
-        '''
-        conn.cursor().execute(sql_str)
+    with report.table(table_name):
+        cursor = conn.cursor()
+        cursor.execute(sql_str, periods)
+        report.count(cursor.rowcount, table_name=table_name)
+
+
+# (date, content hash, changed, rows) for a diary day. A day whose hash matches previous_hashes is unchanged and
+# its rows are just its DiaryDays row, as a table first written to by a changed day fills its gaps from the
+# unchanged days after it. A changed day's rows are those from day_rows or, for the columnar path, the day itself
+# to be transformed with the others
+def transform_day(d, previous_hashes, columnar=False):
+    d_date = diary_date(d['iso8061DateString'])
+    d_hash = record_hash(d)
+    if previous_hashes.get(str(d_date)) == d_hash:
+        return d_date, d_hash, False, [diary_day_row(d_date, d['type'], values_for_sql(d, day_map))]
+    if columnar:
+        return d_date, d_hash, True, d
+    return d_date, d_hash, True, day_rows(d_date, d)
+
+
+# Transforms days in chunks across a process pool, yielding transform_day results in diary order. Chunks are
+# only submitted while fewer than CHUNKS_IN_FLIGHT per worker are outstanding, so the reader cannot run ahead
+# of the writer and pile the diary up in memory. The workers never open the database: every row comes back
+# here to be written on the one connection
+def pipelined_days(days, previous_hashes, workers):
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_worker_previous_hashes,
+                             initargs=(previous_hashes,)) as pool:
+        in_flight = deque()
+        for chunk in chunked(days, TRANSFORM_CHUNK_DAYS):
+            in_flight.append(pool.submit(transform_chunk, chunk))
+            if len(in_flight) >= workers * CHUNKS_IN_FLIGHT:
+                yield from in_flight.popleft().result()
+        while len(in_flight) > 0:
+            yield from in_flight.popleft().result()
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+worker_previous_hashes = dict()
+
+
+def set_worker_previous_hashes(previous_hashes):
+    global worker_previous_hashes
+    worker_previous_hashes = previous_hashes
+
+
+def transform_chunk(days):
+    return [transform_day(d, worker_previous_hashes) for d in days]
+
+
+# Every row a diary day writes as (table, table name, columns, values). table is the (activity, activity type,
+# equipment) of the Day table the row goes in, or None for DiaryDays. Reads nothing from the database so it can
+# run in a worker process
+def day_rows(d_date, d):
+    d_values = values_for_sql(d, day_map)
+    rows = [diary_day_row(d_date, d['type'], d_values)]
+    if 'workouts' in d:
+        for keys, workout, w_values in rollup_workouts(d['workouts']):
+            a, at, e_name = workout_table(workout, keys)
+            rows.append(((a, at, e_name),) + day_row(d_date, d['type'], day_columns + workout_columns,
+                                                     d_values + w_values, a, at, e_name))
+    else:
+        rows.append((('All', 'All', 'All'),) + day_row(d_date, d['type'], day_columns, d_values))
+    return rows
+
 
+def diary_day_row(d_date, d_type, d_values):
+    return (None,) + day_row(d_date, d_type, day_columns, d_values, table_name=DIARY_DAYS)
 
-def save_workouts(conn, d_date, d_type, d_values, workouts):
-    aggregation_keys = [[ACTIVITY, ACTIVITY_TYPE, EQUIPMENT],
-                        [ACTIVITY_TYPE, EQUIPMENT],
-                        [ACTIVITY, EQUIPMENT],
-                        [ACTIVITY, ACTIVITY_TYPE],
-                        [EQUIPMENT],
-                        [ACTIVITY],
-                        [ACTIVITY_TYPE],
-                        []
-                        ]
-    for a in aggregation_keys:
-        agg_workouts = aggregate_workouts(workouts, a)
-        for w in agg_workouts:
-            save_workout(conn, d_date, d_type, d_values, w, a)
 
+def write_day_rows(writer, rows):
+    for table, table_name, columns, values in rows:
+        if table is not None:
+            create_table(DAY, *table, writer.conn)
+        writer.insert(table_name, columns, values)
 
-def save_workout(conn, d_date, d_type, d_values, workout, keys):
 
+# activity, activity type and equipment of the table a workout rolled up on keys belongs in
+def workout_table(workout, keys):
     a = 'All'
     at = 'All'
     e_name = 'All'
@@ -371,96 +902,282 @@ def save_workout(conn, d_date, d_type, d_values, workout, keys):
     if EQUIPMENT in keys:
         e_name = workout[EQUIPMENT].replace(' ', '')
 
-    _ = create_table(DAY, a, at, e_name, conn)
-
-    w_values = value_string_for_sql(workout, workout_map)
+    return a, at, e_name
+
+
+aggregation_keys = [[ACTIVITY, ACTIVITY_TYPE, EQUIPMENT],
+                    [ACTIVITY_TYPE, EQUIPMENT],
+                    [ACTIVITY, EQUIPMENT],
+                    [ACTIVITY, ACTIVITY_TYPE],
+                    [EQUIPMENT],
+                    [ACTIVITY],
+                    [ACTIVITY_TYPE],
+                    []
+                    ]
+
+
+# Combines workouts that share the same values for each set of aggregation_keys, every grouping in one pass.
+# Each workout's contribution to the sums is worked out once and added to the group it falls in for every
+# grouping. Yields (keys, workout, values) in aggregation_keys order where workout carries the group's activity,
+# type and equipment and values are its workout_map values. A group of one workout is that workout as it is
+def rollup_workouts(workouts):
+    groupings = [dict() for _ in aggregation_keys]
+    for i, w in enumerate(workouts):
+        contributions = None
+        for keys, groups in zip(aggregation_keys, groupings):
+            if EQUIPMENT in keys and (w[EQUIPMENT] == NOT_SET or w[EQUIPMENT] == ''):
+                continue
+            key = 'key'
+            if len(keys) > 0:
+                key = ':'.join([w[k] for k in keys])
+            if contributions is None:
+                contributions = rollup_contributions(w)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [i, 1, list(contributions)]
+            else:
+                group[1] += 1
+                sums = group[2]
+                for j, c in enumerate(contributions):
+                    sums[j] += c
+
+    single_values = dict()
+    for keys, groups in zip(aggregation_keys, groupings):
+        for i, count, sums in groups.values():
+            w = workouts[i]
+            if count == 1:
+                if i not in single_values:
+                    single_values[i] = values_for_sql(w, workout_map)
+                yield keys, w, single_values[i]
+            else:
+                d = rollup_workout(w, sums)
+                yield keys, d, values_for_sql(d, workout_map)
 
-    col_names = f'{day_col_names}, {workout_col_names}'
-    d_values = f'{d_values}, {w_values}'
 
-    execute_day_sql(conn, d_date, d_type, col_names, d_values, activity=a, activity_type=at, equipment_name=e_name)
+# one entry per distinct json key in workout_map: (key, mapper, aggregation method, type)
+rollup_fields = [(m[JSON], m.get(MAPPER), m[AGGREGATION_METHOD], m[TYPE]) for i, m in enumerate(workout_map)
+                 if m[JSON] not in [earlier[JSON] for earlier in workout_map[:i]]]
 
 
-# take workouts and combine those that have same Activity:Type:Equipment
-def aggregate_workouts(workouts, keys):
-    agg_w = dict()
-    for w in workouts:
-        key = 'key'
-        if len(keys) > 0:
-            key = ':'.join([w[k] for k in keys])
-        if EQUIPMENT in keys and (w[EQUIPMENT] == NOT_SET or w[EQUIPMENT] == ''):
-            continue
-        if key in agg_w:
-            agg_w[key].append(dict(w))
+# sums are weighted by seconds for the fields that are averaged
+def rollup_contributions(w):
+    contributions = []
+    for key, mapper, method, _ in rollup_fields:
+        if mapper is not None:
+            value = mappers[mapper](w)
         else:
-            agg_w[key] = [dict(w)]
-    result = []
-    for w_array in agg_w.values():
-        if len(w_array) == 1:
-            result.append(w_array[0])
+            value = w[key]
+        if method == SUM:
+            contributions.append(value)
         else:
-            d = dict()
-            d[ACTIVITY] = w_array[0][ACTIVITY]
-            d[ACTIVITY_TYPE] = w_array[0][ACTIVITY_TYPE]
-            d[EQUIPMENT] = w_array[0][EQUIPMENT]
-            for map in workout_map:
-                r = 0
-                for w in w_array:
-                    if MAPPER in map:
-                        value = eval(f'{map[MAPPER]}({w})')
-                    else:
-                        value = w[map[JSON]]
-                    if map[AGGREGATION_METHOD] == SUM:
-                        r += value
-                    else:
-                        r += value * w['seconds']
-                d[map[JSON]] = r
-            for map in workout_map:
-                if map[AGGREGATION_METHOD] == MEAN:
-                    d[map[JSON]] = d[map[JSON]] / d['seconds']
-                    if map[TYPE] == INTEGER:
-                        d[map[JSON]] = int(d[map[JSON]])
-            result.append(d)
+            contributions.append(value * w['seconds'])
+    return contributions
+
+
+def rollup_workout(first, sums):
+    d = dict()
+    d[ACTIVITY] = first[ACTIVITY]
+    d[ACTIVITY_TYPE] = first[ACTIVITY_TYPE]
+    d[EQUIPMENT] = first[EQUIPMENT]
+    for (key, _, _, _), value in zip(rollup_fields, sums):
+        d[key] = value
+    for key, _, method, column_type in rollup_fields:
+        if method == MEAN:
+            d[key] = d[key] / d['seconds']
+            if column_type == INTEGER:
+                d[key] = int(d[key])
+    return d
+
+
+# Bulk alternative to writing each day's day_rows. All the days and their workouts are
+# normalised into DataFrames, the calendar columns and map factors are worked out as column operations and every
+# table gets its rows in one executemany. Gives the same rows as the row at a time path
+def save_days_columnar(writer, days):
+    conn = writer.conn
+    day_df = pd.DataFrame(days)
+    day_df.index = range(len(day_df))
+
+    dates = pd.to_datetime(day_df['iso8061DateString'].str[:10])
+    day_rows = pd.DataFrame({'date': dates.dt.strftime('%Y-%m-%d'),
+                             'year_week': dates.dt.year.astype(str) + '-' + dates.dt.isocalendar().week.astype(str),
+                             'year_month': dates.dt.year.astype(str) + '-' + dates.dt.strftime('%b'),
+                             'day_of_week': dates.dt.strftime('%a'),
+                             'month': dates.dt.strftime('%b'),
+                             'day_type': day_df['type'].astype(str)})
+    day_rows = pd.concat([day_rows, map_columns(day_df, day_map)], axis=1)
+    day_row_columns = ['date'] + calendar_columns + day_columns
+    writer.insert_many(DIARY_DAYS, day_row_columns, day_rows.itertuples(index=False, name=None))
+
+    has_workouts = day_df['workouts'].map(lambda w: isinstance(w, list)) if 'workouts' in day_df else \
+        pd.Series(False, index=day_df.index)
+    if not has_workouts.all():
+        create_table(DAY, 'All', 'All', 'All', conn)
+        writer.insert_many(f'{DAY}_All_All_All', day_row_columns,
+                           day_rows[~has_workouts.to_numpy()].itertuples(index=False, name=None))
+
+    workouts = []
+    workout_days = []
+    for i, ws in day_df.loc[has_workouts, 'workouts'].items():
+        workouts += ws
+        workout_days += [i] * len(ws)
+    if len(workouts) == 0:
+        return
+    w_df = pd.DataFrame(workouts)
+    w_df['day'] = workout_days
 
-    return result
+    rollups = pd.concat([rollup_columnar(w_df, keys) for keys in aggregation_keys], ignore_index=True)
+    rollups = rollups.drop_duplicates(subset=['table_name', 'day'], keep='first')
+    rollups = rollups.merge(day_rows, left_on='day', right_index=True, how='left', sort=False)
 
+    columns = day_row_columns + workout_columns
+    for (a, at, e_name, table_name), rows in rollups.groupby(['activity', 'activity_type', 'equipment', 'table_name'],
+                                                             sort=False):
+        create_table(DAY, a, at, e_name, conn)
+        writer.insert_many(table_name, columns, rows[columns].sort_values('date').itertuples(index=False, name=None))
 
-def value_string_for_sql(dictionary, json_map):
-    d_value_array = []
+
+# one row per group of workouts sharing a day and keys, in the order the groups first appear, with the
+# table it belongs in and its workout_map columns. Matches rollup_workouts
+def rollup_columnar(w_df, keys):
+    w_df = w_df.reset_index(drop=True)
+    if EQUIPMENT in keys:
+        w_df = w_df[~w_df[EQUIPMENT].isin([NOT_SET, ''])].reset_index(drop=True)
+    if len(w_df) == 0:
+        return pd.DataFrame()
+
+    codes = w_df.groupby(['day'] + keys, sort=False).ngroup().to_numpy()
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    counts = np.diff(np.r_[starts, len(order)])
+    first = order[starts]
+
+    # sums are taken in workout order within each group, as the row at a time rollup adds them
+    seconds = column_values(w_df, 'seconds', 0)
+    sums = dict()
+    for key, mapper, method, _ in rollup_fields:
+        if mapper is not None:
+            values = column_mappers[mapper](w_df)
+        else:
+            values = column_values(w_df, key, 0)
+        if method != SUM:
+            values = values * seconds
+        sums[key] = sequential_sums(values[order], starts, counts)
+    for key, _, method, column_type in rollup_fields:
+        if method == MEAN:
+            sums[key] = sums[key] / sums['seconds']
+            if column_type == INTEGER:
+                sums[key] = np.trunc(sums[key])
+
+    values = map_columns(w_df, workout_map).iloc[first].reset_index(drop=True)
+    combined = counts > 1
+    if combined.any():
+        aggregated = map_columns(pd.DataFrame({k: v[combined] for k, v in sums.items()}), workout_map)
+        values.loc[combined, :] = aggregated.to_numpy()
+
+    firsts = w_df.iloc[first].reset_index(drop=True)
+    result = pd.DataFrame({'day': firsts['day'],
+                           'activity': firsts[ACTIVITY] if ACTIVITY in keys else 'All',
+                           'activity_type': firsts[ACTIVITY_TYPE] if ACTIVITY_TYPE in keys else 'All',
+                           'equipment': firsts[EQUIPMENT].str.replace(' ', '') if EQUIPMENT in keys else 'All'})
+    result['table_name'] = DAY + '_' + result['activity'] + '_' + result['activity_type'] + '_' + result['equipment']
+    return pd.concat([result, values], axis=1)
+
+
+# adds up each group one position at a time so float sums round exactly as the row at a time rollup's do.
+# np.add.reduceat does not promise that order of addition
+def sequential_sums(values, starts, counts):
+    sums = values[starts].astype(float)
+    for k in range(1, counts.max()):
+        more = counts > k
+        sums[more] += values[starts[more] + k]
+    return sums
+
+
+# column arithmetic equivalent of values_for_sql: one column per json_map entry
+def map_columns(df, json_map):
+    columns = dict()
     for m in json_map:
         if MAPPER in m:
-            value = eval(f'{m[MAPPER]}({dictionary})')
-            d_value_array.append(str(value))
+            columns[m[DB_COL]] = column_mappers[m[MAPPER]](df)
         elif m[TYPE] == INTEGER:
-            d_value_array.append(str(int(round(float(dictionary[m[JSON]]) * m[FACTOR], 0))))
+            columns[m[DB_COL]] = np.rint(column_values(df, m[JSON], m[DEFAULT]) * m[FACTOR]).astype(np.int64)
         elif m[TYPE] == REAL:
-            d_value_array.append(str(round(float(dictionary[m[JSON]]) * m[FACTOR],2)))
+            columns[m[DB_COL]] = round_half_even(column_values(df, m[JSON], m[DEFAULT]) * m[FACTOR], 2)
         elif m[TYPE] == BOOLEAN:
-            if dictionary[m[JSON]] == 0:
-                d_value_array.append('0')
-            else:
-                d_value_array.append('1')
+            columns[m[DB_COL]] = (column_values(df, m[JSON], m[DEFAULT]) != 0).astype(np.int64)
         else:
-            d_value_array.append(f"'{dictionary[m[JSON]]}'")
+            values = df[m[JSON]] if m[JSON] in df else pd.Series(m[DEFAULT], index=df.index)
+            columns[m[DB_COL]] = values.fillna(m[DEFAULT]).astype(str).to_numpy()
+    return pd.DataFrame(columns, index=range(len(df)))
+
+
+def column_values(df, key, default):
+    if key not in df:
+        return np.full(len(df), float(default))
+    return df[key].fillna(default).astype(float).to_numpy()
+
+
+# round() for arrays. rint of the scaled value is the same as round() except within rounding error of a half,
+# so those few values are passed to round() itself
+def round_half_even(values, digits):
+    scale = 10.0 ** digits
+    scaled = values * scale
+    result = np.rint(scaled) / scale
+    near_half = np.abs(np.abs(scaled - np.floor(scaled)) - 0.5) < 1e-6
+    if near_half.any():
+        result[near_half] = [round(v, digits) for v in values[near_half].tolist()]
+    return result
 
-    return ','.join([s for s in d_value_array])
 
+# tuple of values in json_map order, typed for binding as statement parameters
+def values_for_sql(dictionary, json_map):
+    return tuple([extract(dictionary) for extract in extraction_plan(json_map)])
 
-def day_exists(d, table, conn):
-    sql_str = f'''
-            SELECT id FROM {table} WHERE date="{d}"
-    '''
-    result = conn.cursor().execute(sql_str)
-    return len(result.fetchall()) > 0
+
+extraction_plans = dict()
+
+
+# json_map compiled once into a function per column with its mapper, factor, type and default bound in
+def extraction_plan(json_map):
+    plan = extraction_plans.get(id(json_map))
+    if plan is None:
+        plan = [column_extractor(m) for m in json_map]
+        extraction_plans[id(json_map)] = plan
+    return plan
+
+
+def column_extractor(m):
+    if MAPPER in m:
+        return mappers[m[MAPPER]]
+
+    key = m[JSON]
+    default = m[DEFAULT]
+    if m[TYPE] == INTEGER:
+        factor = m[FACTOR]
+        return lambda d: int(round(float(d.get(key, default)) * factor, 0))
+    if m[TYPE] == REAL:
+        factor = m[FACTOR]
+        return lambda d: round(float(d.get(key, default)) * factor, 2)
+    if m[TYPE] == BOOLEAN:
+        return lambda d: 0 if d.get(key, default) == 0 else 1
+    return lambda d: str(d.get(key, default))
+
+
+def load_catalog(conn):
+    table_names.clear()
+    for table_name, period in conn.cursor().execute('SELECT table_name, period FROM Tables'):
+        table_names[table_name] = period
 
 
 def create_table(period, activity, activity_type, equipment_name, conn):
 
     table_name = f'{period}_{activity}_{activity_type}_{equipment_name}'
+    if table_name in table_names:
+        return table_name
 
     sql_str = f'''
     
-        CREATE TABLE {table_name}
+        CREATE TABLE IF NOT EXISTS {table_name}
         (id INTEGER PRIMARY KEY AUTOINCREMENT,
         date DATE UNIQUE,
         year_week VARCHAR(16),
@@ -474,65 +1191,173 @@ def create_table(period, activity, activity_type, equipment_name, conn):
         {physiological_col_creation})
         '''
 
-    try:
+    if period == DAY and storage_layout == FACT_LAYOUT:
+        create_day_view(conn, table_name, activity, activity_type, equipment_name)
+    else:
         conn.cursor().execute(sql_str)
-        conn.commit()
-        table_names.add(table_name)
 
-        sql_str = f"""
+    sql_str = f"""
+
+        INSERT OR IGNORE INTO Tables
+        (period, activity, activity_type, equipment, table_name)
+        VALUES
+        (?, ?, ?, ?, ?)
+
+    """
+    conn.cursor().execute(sql_str, (period, activity, activity_type, equipment_name, table_name))
+    table_names[table_name] = period
+
+    return table_name
+
+
+# creates whichever of period_indexes and shared_indexes are missing. The fact layout's Day_* views have none of
+# their own, their rows are found through the fact table's UNIQUE index
+def create_indexes(conn):
+    for table_name, period in table_names.items():
+        if period == DAY and storage_layout == FACT_LAYOUT:
+            continue
+        create_table_indexes(conn, table_name, period_indexes[period])
+    for table_name, indexes in shared_indexes.items():
+        if table_name == DAY_INFO and storage_layout != FACT_LAYOUT:
+            continue
+        create_table_indexes(conn, table_name, indexes)
+
 
-            INSERT INTO Tables
-            (period, activity, activity_type, equipment, table_name)
-            VALUES
-            ('{period}',
-            '{activity}',
-            '{activity_type}',
-            '{equipment_name}',
-            '{table_name}'
-            )
+def create_table_indexes(conn, table_name, indexes):
+    for suffix, columns in indexes:
+        conn.cursor().execute(f'CREATE INDEX IF NOT EXISTS {table_name}_{suffix} ON {table_name} ({", ".join(columns)})')
 
-        """
+
+def layout_of(conn):
+    sql_str = f'SELECT name FROM sqlite_master WHERE type="table" AND name="{FACT_TABLE}"'
+    if conn.cursor().execute(sql_str).fetchone() is None:
+        return TABLE_LAYOUT
+    return FACT_LAYOUT
+
+
+def create_fact_tables(conn):
+    sql_str = f'''
+        CREATE TABLE IF NOT EXISTS {FACT_TABLE}
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        activity VARCHAR(32),
+        activity_type VARCHAR(32),
+        equipment VARCHAR(32),
+        date DATE,
+        {workout_col_creation},
+        {calculated_col_creation},
+        UNIQUE (activity, activity_type, equipment, date))
+    '''
+    conn.cursor().execute(sql_str)
+    conn.cursor().execute(f'CREATE INDEX IF NOT EXISTS {FACT_TABLE}_date ON {FACT_TABLE} (date)')
+
+    sql_str = f'''
+        CREATE TABLE IF NOT EXISTS {DAY_INFO}
+        (date DATE PRIMARY KEY,
+        {calendar_col_creation},
+        {day_col_creation})
+    '''
+    conn.cursor().execute(sql_str)
+
+    sql_str = f'''
+        CREATE TABLE IF NOT EXISTS {PHYSIOLOGICALS}
+        (date DATE PRIMARY KEY,
+        {physiological_col_creation})
+    '''
+    conn.cursor().execute(sql_str)
+    conn.commit()
+
+
+# a view with the same name and columns as the Day_* table it replaces. The triggers send inserts, updates
+# and deletes on to the fact, day info and physiological tables
+def create_day_view(conn, table_name, activity, activity_type, equipment_name):
+    fact_columns = workout_columns + calculated_columns
+    info_columns = calendar_columns + day_columns
+    fact_defaults = {m[DB_COL]: m[DEFAULT] for m in workout_map}
+    info_defaults = {m[DB_COL]: m[DEFAULT] for m in day_map}
+
+    def set_str(columns):
+        return ', '.join(f'{c}=NEW.{c}' for c in columns)
+
+    def value_str(columns, defaults):
+        return ', '.join(f'COALESCE(NEW.{c}, {sql_literal(defaults[c])})' if c in defaults else f'NEW.{c}'
+                         for c in columns)
+
+    sql_strs = [f'''
+        CREATE VIEW IF NOT EXISTS {table_name} AS
+        SELECT f.id AS id, f.date AS date,
+        {', '.join(f'i.{c} AS {c}' for c in info_columns)},
+        {', '.join(f'f.{c} AS {c}' for c in fact_columns)},
+        {', '.join(f'p.{c} AS {c}' for c in physiological_columns)}
+        FROM {FACT_TABLE} f
+        JOIN {DAY_INFO} i ON i.date = f.date
+        LEFT JOIN {PHYSIOLOGICALS} p ON p.date = f.date
+        WHERE f.activity='{activity}' AND f.activity_type='{activity_type}' AND f.equipment='{equipment_name}'
+    ''', f'''
+        CREATE TRIGGER IF NOT EXISTS {table_name}_insert INSTEAD OF INSERT ON {table_name}
+        BEGIN
+            INSERT OR IGNORE INTO {DAY_INFO} (date, {', '.join(info_columns)})
+            VALUES (NEW.date, {value_str(info_columns, info_defaults)});
+            INSERT OR IGNORE INTO {PHYSIOLOGICALS} (date) VALUES (NEW.date);
+            INSERT INTO {FACT_TABLE} (activity, activity_type, equipment, date, {', '.join(workout_columns)})
+            VALUES ('{activity}', '{activity_type}', '{equipment_name}', NEW.date,
+            {value_str(workout_columns, fact_defaults)});
+        END
+    ''', f'''
+        CREATE TRIGGER IF NOT EXISTS {table_name}_update_facts INSTEAD OF UPDATE OF {', '.join(fact_columns)} ON {table_name}
+        BEGIN
+            UPDATE {FACT_TABLE} SET {set_str(fact_columns)} WHERE id=OLD.id;
+        END
+    ''', f'''
+        CREATE TRIGGER IF NOT EXISTS {table_name}_update_info INSTEAD OF UPDATE OF {', '.join(info_columns)} ON {table_name}
+        BEGIN
+            UPDATE {DAY_INFO} SET {set_str(info_columns)} WHERE date=OLD.date;
+        END
+    ''', f'''
+        CREATE TRIGGER IF NOT EXISTS {table_name}_update_physiologicals INSTEAD OF UPDATE OF {', '.join(physiological_columns)}
+        ON {table_name}
+        BEGIN
+            UPDATE {PHYSIOLOGICALS} SET {set_str(physiological_columns)} WHERE date=OLD.date;
+        END
+    ''', f'''
+        CREATE TRIGGER IF NOT EXISTS {table_name}_delete INSTEAD OF DELETE ON {table_name}
+        BEGIN
+            DELETE FROM {FACT_TABLE} WHERE id=OLD.id;
+        END
+    ''']
+    for sql_str in sql_strs:
         conn.cursor().execute(sql_str)
-        conn.commit()
 
-    except Exception as e:
-        pass
 
-    return table_name
+def sql_literal(value):
+    if isinstance(value, str):
+        return f"'{value}'"
+    return str(value)
 
 
-def execute_day_sql(conn, d_date, d_type, col_names, values, activity='All', activity_type='All', equipment_name='All', table_name=None):
+# (table name, columns, values) of a day's row with the calendar columns worked out from d_date
+def day_row(d_date, d_type, columns, values, activity='All', activity_type='All', equipment_name='All', table_name=None):
 
     t_name = table_name
     if table_name is None:
         t_name = f'{DAY}_{activity}_{activity_type}_{equipment_name}'
 
-    d_month = f'{d_date.year}-{d_date.strftime("%b")}'
-    d_week = f'{d_date.year}-{d_date.isocalendar()[1]}'
-    d_day = d_date.strftime('%a')
-    month = d_date.strftime('%b')
+    return (t_name, ['date', 'year_week', 'year_month', 'day_of_week', 'month', 'day_type'] + columns,
+            calendar_values(d_date) + (d_type,) + values)
 
-    sql_str = f'''
 
-        INSERT INTO {t_name}
-        (date, year_week, year_month, day_of_week, month, day_type, {col_names})
-        VALUES
-        (
-        '{d_date}',
-        '{d_week}',
-        '{d_month}',
-        '{d_day}',
-        '{month}',
-        '{d_type}',
-        {values}
-        )
-    '''
+calendar_cache = dict()
+
+
+# (date, year_week, year_month, day_of_week, month) worked out once per date and shared by every table it is written to
+def calendar_values(d_date):
+    values = calendar_cache.get(d_date)
+    if values is None:
+        month = d_date.strftime('%b')
+        values = (str(d_date), f'{d_date.year}-{d_date.isocalendar()[1]}', f'{d_date.year}-{month}',
+                  d_date.strftime('%a'), month)
+        calendar_cache[d_date] = values
+    return values
 
-    try:
-        conn.cursor().execute(sql_str)
-        # conn.commit()
-    except Exception as e:
-        print(e)
 
 def create_agg_and_insert_str_for_sql():
     aggregate_array = ['MAX(date)']
@@ -581,32 +1406,111 @@ def rpe_tss_mapper(workout_dict):
 
     return result
 
+
+def mph_column(df):
+    km = column_values(df, 'km', 0)
+    seconds = column_values(df, 'seconds', 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = round_half_even(km * MILES_PER_KM * 60 * 60 / seconds, 1)
+    return np.where(seconds > 0, result, 0.0)
+
+
+def kph_column(df):
+    km = column_values(df, 'km', 0)
+    seconds = column_values(df, 'seconds', 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = round_half_even(km * 60 * 60 / seconds, 1)
+    return np.where(seconds > 0, result, 0.0)
+
+
+def rpe_tss_column(df):
+    rpe = column_values(df, 'rpe', 0)
+    seconds = column_values(df, 'seconds', 0)
+    result = round_half_even(rpe * rpe * seconds / (49 * 36), 1)
+    return np.where(seconds > 0, result, 0.0)
+
+
+mappers = {'rpe_tss_mapper': rpe_tss_mapper,
+           'mph_mapper': mph_mapper,
+           'kph_mapper': kph_mapper}
+
+column_mappers = {'rpe_tss_mapper': rpe_tss_column,
+                  'mph_mapper': mph_column,
+                  'kph_mapper': kph_column}
+
+
 if __name__ == '__main__':
-    start = datetime.datetime.now()
-    print('Basic day info...')
-    populate()
-    print(f'DONE in {datetime.datetime.now() - start}')
-
-    start = datetime.datetime.now()
-    print('Calculating TSB ...')
-    calculate_all_tsb()
-    print(f'DONE in {datetime.datetime.now() - start}')
-
-    start = datetime.datetime.now()
-    print('Calculating Strain ...')
-    calculate_all_strain()
-    print(f'DONE in {datetime.datetime.now() - start}')
-
-    # start = datetime.datetime.now()
-    # print('Creating weekly tables ...')
-    # create_and_populate_agg_tables(WEEK)
-    # print(f'DONE in {datetime.datetime.now() - start}')
-    #
-    # start = datetime.datetime.now()
-    # print('Creating monthly tables ...')
-    # create_and_populate_agg_tables(MONTH)
-    # print(f'DONE in {datetime.datetime.now() - start}')
-
-    # f = open('TrainingDiary.json')
-    # data = json.load(f)
-    # populate_kg_fat_percent(data)
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--incremental', action='store_true',
+                            help='only load days that changed since the last run and recalculate from there')
+    arg_parser.add_argument('--layout', choices=[TABLE_LAYOUT, FACT_LAYOUT],
+                            help='storage layout for a new warehouse, an existing one keeps its layout')
+    arg_parser.add_argument('--columnar', action='store_true',
+                            help='transform all the changed days at once with pandas rather than day by day')
+    arg_parser.add_argument('--workers', type=int, default=1,
+                            help='number of processes calculating TSB and strain')
+    arg_parser.add_argument('--transform-workers', type=int, default=1,
+                            help='number of processes turning diary days into rows while this one writes them')
+    arg_parser.add_argument('--profile', choices=load_profiles, default=SHARED_LOAD,
+                            help=f'connection pragmas for the load. {SHARED_LOAD} lets dashboards keep reading '
+                                 f'meanwhile, {BULK_LOAD} locks them out and fails while one has the warehouse open')
+    arg_parser.add_argument('--build', metavar='memory|DIRECTORY',
+                            help='build in memory or in a scratch file in DIRECTORY, e.g. /dev/shm, then swap the '
+                                 'finished warehouse into place')
+    arg_parser.add_argument('--export', metavar='DIRECTORY',
+                            help='keep a Parquet copy of the warehouse in DIRECTORY up to date, needs pyarrow')
+    arg_parser.add_argument('--resume', action='store_true',
+                            help='finish the last run that stopped part way, skipping the stages and tables it '
+                                 'completed. Give it the options that run was started with')
+    arg_parser.add_argument('--report', help='write per stage and per table timings and counts to this JSON file')
+    arg_parser.add_argument('--cprofile', help='profile the run with cProfile and write the stats to this file')
+    arg_parser.add_argument('--tracemalloc', action='store_true',
+                            help='record the peak memory Python allocated in each stage in the report')
+    args = arg_parser.parse_args()
+    if args.build == MEMORY and args.workers > 1:
+        arg_parser.error('an in memory build cannot be shared with --workers processes, build in a directory')
+    if args.resume and args.build is not None:
+        arg_parser.error('a build is thrown away when it stops part way, so --resume cannot be used with --build')
+    # parquet_export and load_models import this module so they are only imported once the loader is running
+    from parquet_export import PYARROW_MISSING, pa, export_warehouse
+    from load_models import calculate_load_models
+    if args.export is not None and pa is None:
+        arg_parser.error(PYARROW_MISSING)
+    if args.columnar and args.transform_workers > 1:
+        arg_parser.error('--columnar transforms all the days at once and cannot be split across --transform-workers')
+
+    if args.cprofile is not None:
+        report.start_profiler()
+    if args.tracemalloc:
+        report.start_tracemalloc()
+    if args.build is not None:
+        start_build(args.build)
+    ledger.start(args.resume, args.profile)
+
+    changed_since, physiologicals_since = populate(incremental=args.incremental, layout=args.layout,
+                                                   columnar=args.columnar, profile=args.profile,
+                                                   transform_workers=args.transform_workers)
+
+    if changed_since is not None:
+        calculate_all_tsb(changed_since, args.workers, args.profile)
+        calculate_all_strain(changed_since, args.workers, args.profile)
+        calculate_load_models(changed_since, args.profile)
+        create_and_populate_agg_tables(WEEK, args.profile, changed_since)
+        create_and_populate_agg_tables(MONTH, args.profile, changed_since)
+    export_since = min([d for d in [changed_since, physiologicals_since] if d is not None], default=None)
+    if export_since is not None:
+        advance_generation(args.profile)
+    else:
+        print('No changes')
+
+    if args.export is not None:
+        with report.stage('parquet export'):
+            export_warehouse(args.export, export_since, args.profile)
+    ledger.finish()
+
+    if args.build is not None:
+        with report.stage('swap into place'):
+            finish_build()
+
+    report.write(args.report, args.cprofile)
+    print(f'DONE in {datetime.datetime.now() - report.started}')
@@ -0,0 +1,36 @@
+import numpy as np
+
+
+# Sums, means and sample standard deviations over the last size values of one or more series held as the columns
+# of a 2d array. Every statistic comes from the window's sum and sum of squares. The last size - 1 values are kept
+# between calls so a series can be extended a block at a time and give the same results as one pass over all of it
+class RollingWindow:
+
+    def __init__(self, size, columns=1):
+        self.size = size
+        self.tail = np.zeros((0, columns))
+        self.count = 0
+
+    # returns (sums, means, stds), each with a row per value. std is NaN while the window holds a single value
+    def extend(self, values):
+        values = np.asarray(values, dtype=float).reshape(-1, self.tail.shape[1])
+        n = len(values)
+        padding = np.zeros((self.size - 1 - len(self.tail), values.shape[1]))
+        series = np.concatenate([padding, self.tail, values])
+
+        sums = np.zeros_like(values)
+        squares = np.zeros_like(values)
+        for k in range(self.size):
+            window_values = series[k:k + n]
+            sums += window_values
+            squares += window_values * window_values
+
+        counts = np.minimum(np.arange(self.count + 1, self.count + n + 1), self.size).astype(float)[:, None]
+        means = sums / counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variances = np.where(counts > 1, (squares - sums * means) / (counts - 1), np.nan)
+        stds = np.sqrt(np.maximum(variances, 0))
+
+        self.tail = series[len(series) - (self.size - 1):]
+        self.count += n
+        return sums, means, stds
@@ -0,0 +1,136 @@
+import sys
+import datetime
+from db_connection import BULK_LOAD, connect
+
+LOAD_RUNS = 'LoadRuns'
+RUN_LEDGER = 'RunLedger'
+RUNNING = 'running'
+FINISHED = 'finished'
+SUPERSEDED = 'superseded'
+# the table_name of a ledger row for a stage done as a whole rather than table by table
+WHOLE_STAGE = ''
+
+
+# Records how far the loader has got so a run that stops part way can be finished with --resume rather than
+# started again. LoadRuns has a row per run with the dates its days stage found changed and RunLedger a row for
+# each stage, or each table of the stages that work table by table, as it completes. done writes the row and
+# commits on the stage's own connection, so whatever the ledger holds is in the warehouse too and a stage cut off
+# part way is run again from its last committed table. Every stage is safe to repeat. The loader keeps one ledger
+# per process in ledger below. Until start is called nothing is recorded and nothing is done, so the stages
+# behave as before when run outside the loader
+class RunLedger:
+
+    def __init__(self):
+        self.run = None
+        self.profile = BULK_LOAD
+        self.completed = set()
+        self.since = None
+        self.min_date = None
+        self.max_date = None
+        self.carried_since = None
+
+    # Picks up the last unfinished run with resume, or starts a new one. While earlier runs are unfinished the
+    # run carries on from the earliest date they changed, as they may have saved their diary hashes without
+    # getting as far as the derived columns
+    def start(self, resume=False, profile=BULK_LOAD):
+        self.profile = profile
+        conn = connect(profile)
+        create_ledger_tables(conn)
+        sql_str = f'''
+            SELECT run, started, since, min_date, max_date FROM {LOAD_RUNS}
+            WHERE status=? ORDER BY run DESC LIMIT 1
+        '''
+        unfinished = conn.cursor().execute(sql_str, (RUNNING,)).fetchone()
+        sql_str = f'SELECT MIN(since) FROM {LOAD_RUNS} WHERE status=?'
+        carried = conn.cursor().execute(sql_str, (RUNNING,)).fetchone()[0]
+        self.carried_since = None if carried is None else datetime.date.fromisoformat(carried)
+
+        if resume and unfinished is not None:
+            self.run, started, since, min_date, max_date = unfinished
+            self.since, self.min_date, self.max_date = [None if d is None else datetime.date.fromisoformat(d)
+                                                        for d in [since, min_date, max_date]]
+            sql_str = f'SELECT stage, table_name FROM {RUN_LEDGER} WHERE run=?'
+            self.completed = set(conn.cursor().execute(sql_str, (self.run,)).fetchall())
+            print(f'Resuming run {self.run} started {started}, {len(self.completed)} stages and tables done')
+        else:
+            if resume:
+                print('No unfinished run to resume, starting a new one')
+            sql_str = f'INSERT INTO {LOAD_RUNS} (started, arguments, status) VALUES (?, ?, ?)'
+            cursor = conn.cursor()
+            cursor.execute(sql_str, (now(), ' '.join(sys.argv[1:]), RUNNING))
+            self.run = cursor.lastrowid
+        conn.commit()
+        conn.close()
+
+    def is_done(self, stage, table_name=WHOLE_STAGE):
+        return (stage, table_name) in self.completed
+
+    # records the stage or table and commits it with the work written on conn, flushing writer first
+    def done(self, conn, stage, table_name=WHOLE_STAGE, writer=None):
+        if self.run is None:
+            return
+        if writer is not None:
+            writer.flush()
+        sql_str = f'INSERT OR REPLACE INTO {RUN_LEDGER} (run, stage, table_name, completed) VALUES (?, ?, ?, ?)'
+        conn.cursor().execute(sql_str, (self.run, stage, table_name, now()))
+        conn.commit()
+        self.completed.add((stage, table_name))
+
+    # Records the days stage with the dates the rest of the run works from and returns the date to recalculate
+    # from, the earlier of since and any date carried from unfinished runs. Those runs are superseded by this one
+    def days_done(self, conn, since, min_date, max_date):
+        if self.run is None:
+            return since
+        if self.carried_since is not None and (since is None or self.carried_since < since):
+            since = self.carried_since
+        self.since, self.min_date, self.max_date = since, min_date, max_date
+        sql_str = f'UPDATE {LOAD_RUNS} SET since=?, min_date=?, max_date=? WHERE run=?'
+        conn.cursor().execute(sql_str, (None if since is None else str(since), str(min_date), str(max_date), self.run))
+        sql_str = f'UPDATE {LOAD_RUNS} SET status=? WHERE status=? AND run<?'
+        conn.cursor().execute(sql_str, (SUPERSEDED, RUNNING, self.run))
+        self.done(conn, 'days')
+        return since
+
+    # the run's stage and table rows are only needed to resume it so they go once it has finished
+    def finish(self):
+        if self.run is None:
+            return
+        conn = connect(self.profile)
+        conn.cursor().execute(f'UPDATE {LOAD_RUNS} SET status=?, finished=? WHERE run=?',
+                              (FINISHED, now(), self.run))
+        conn.cursor().execute(f'DELETE FROM {RUN_LEDGER} WHERE run=?', (self.run,))
+        conn.commit()
+        conn.close()
+
+
+def create_ledger_tables(conn):
+    sql_str = f'''
+        CREATE TABLE IF NOT EXISTS {LOAD_RUNS}
+        (run INTEGER PRIMARY KEY AUTOINCREMENT,
+        started TIMESTAMP,
+        arguments TEXT,
+        since DATE,
+        min_date DATE,
+        max_date DATE,
+        status VARCHAR(16),
+        finished TIMESTAMP)
+    '''
+    conn.cursor().execute(sql_str)
+
+    sql_str = f'''
+        CREATE TABLE IF NOT EXISTS {RUN_LEDGER}
+        (run INTEGER,
+        stage VARCHAR(32),
+        table_name VARCHAR(100),
+        completed TIMESTAMP,
+        PRIMARY KEY (run, stage, table_name))
+        WITHOUT ROWID
+    '''
+    conn.cursor().execute(sql_str)
+
+
+def now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+ledger = RunLedger()
@@ -0,0 +1,84 @@
+from instrumentation import report
+
+BATCH_SIZE = 10000
+
+# (table, columns, key columns) -> statement, shared by every writer in the process so each statement is built once
+statements = dict()
+
+
+# Buffers rows for parameterized INSERT and keyed UPDATE statements and writes them with executemany, one
+# transaction per flush. Statements come from the statements registry. Buffered statements are executed in the
+# order they were first used, so callers must not rely on reading back rows that are still buffered.
+class BatchWriter:
+
+    def __init__(self, conn, batch_size=BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.buffers = dict()
+        self.pending = 0
+        self.rows_written = 0
+        self.statements_executed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    # rows whose date is already in the table are skipped, as the UNIQUE date constraint used to reject them
+    def insert(self, table_name, columns, row):
+        self.add(self.insert_statement(table_name, columns), row)
+
+    def insert_many(self, table_name, columns, rows):
+        sql_str = self.insert_statement(table_name, columns)
+        for row in rows:
+            self.add(sql_str, row)
+
+    def insert_statement(self, table_name, columns):
+        key = (table_name, tuple(columns), None)
+        sql_str = statements.get(key)
+        if sql_str is None:
+            sql_str = f'''
+                INSERT OR IGNORE INTO {table_name}
+                ({','.join(columns)})
+                VALUES
+                ({','.join('?' for _ in columns)})
+            '''
+            statements[key] = sql_str
+        return sql_str
+
+    # row holds the values for columns followed by the values for key_columns
+    def update(self, table_name, columns, key_columns, row):
+        key = (table_name, tuple(columns), tuple(key_columns))
+        sql_str = statements.get(key)
+        if sql_str is None:
+            sql_str = f'''
+                UPDATE {table_name} SET
+                {','.join(f'{c}=?' for c in columns)}
+                WHERE {' AND '.join(f'{k}=?' for k in key_columns)}
+            '''
+            statements[key] = sql_str
+        self.add(sql_str, row)
+
+    def add(self, sql_str, row):
+        rows = self.buffers.get(sql_str)
+        if rows is None:
+            rows = []
+            self.buffers[sql_str] = rows
+        rows.append(row)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending == 0:
+            return
+        with self.conn:
+            for sql_str, rows in self.buffers.items():
+                self.conn.cursor().executemany(sql_str, rows)
+        self.statements_executed += len(self.buffers)
+        self.rows_written += self.pending
+        report.count(self.pending, len(self.buffers))
+        self.buffers = dict()
+        self.pending = 0
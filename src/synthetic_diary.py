@@ -0,0 +1,126 @@
+import json
+import random
+import argparse
+import datetime
+
+ACTIVITIES = {'Swim': ['Squad', 'OpenWater', 'Solo'],
+              'Bike': ['Road', 'Turbo', 'MTB'],
+              'Run': ['Road', 'Trail', 'Treadmill'],
+              'Gym': ['General', 'Core']}
+EQUIPMENT = {'Swim': ['Not Set'],
+             'Bike': ['Trek Madone', 'Cervelo P3', 'Not Set'],
+             'Run': ['Nike Pegasus', 'Hoka Clifton', ''],
+             'Gym': ['Not Set']}
+DAY_TYPES = ['Normal', 'Normal', 'Normal', 'Rest', 'Race', 'Recovery']
+SLEEP_QUALITY = ['Excellent', 'Good', 'Average', 'Poor']
+
+
+# Writes a synthetic TrainingDiary.json with the fields populate() reads. Records are written one at a time
+# so a diary of any length can be generated without holding it in memory. A training day has 1 to workouts
+# workouts. With equipment set each activity has that many named pieces of equipment in place of EQUIPMENT,
+# which sets how many Day_* tables the load creates
+def write_diary(path, years=20, seed=1, start=datetime.date(2000, 1, 1), workouts=3, equipment=None):
+    rng = random.Random(seed)
+    number_of_days = int(round(years * 365.25))
+    names = equipment_names(equipment)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"days": [')
+        write_records(f, (synthetic_day(rng, start + datetime.timedelta(days=i), workouts, names)
+                          for i in range(number_of_days)))
+        f.write('],\n"weights": [')
+        write_records(f, synthetic_weights(rng, start, number_of_days))
+        f.write('],\n"physiologicals": [')
+        write_records(f, synthetic_physiologicals(rng, start, number_of_days))
+        f.write(']}\n')
+    return number_of_days
+
+
+def equipment_names(equipment=None):
+    if equipment is None:
+        return EQUIPMENT
+    names = dict()
+    for activity in ACTIVITIES:
+        names[activity] = [f'{activity} Kit {i + 1}' for i in range(equipment)] + ['Not Set']
+    return names
+
+
+def write_records(f, records):
+    separator = '\n'
+    for r in records:
+        f.write(separator)
+        f.write(json.dumps(r))
+        separator = ',\n'
+
+
+def iso_string(d):
+    return f'{d.isoformat()}T00:00:00Z'
+
+
+def synthetic_day(rng, d, workouts=3, equipment=EQUIPMENT):
+    day = {'iso8061DateString': iso_string(d),
+           'type': rng.choice(DAY_TYPES),
+           'fatigue': rng.randint(1, 10),
+           'motivation': rng.randint(1, 10),
+           'sleep': round(rng.uniform(5.0, 9.5), 2),
+           'sleepQuality': rng.choice(SLEEP_QUALITY)}
+    if rng.random() < 0.85:
+        day['workouts'] = [synthetic_workout(rng, equipment) for _ in range(rng.randint(1, workouts))]
+    return day
+
+
+def synthetic_workout(rng, equipment=EQUIPMENT):
+    activity = rng.choice(list(ACTIVITIES))
+    seconds = rng.randint(900, 3 * 60 * 60)
+    km = 0.0
+    if activity != 'Gym':
+        km = round(seconds / 3600.0 * rng.uniform(3.0, 35.0), 2)
+    return {'activityString': activity,
+            'activityTypeString': rng.choice(ACTIVITIES[activity]),
+            'equipmentName': rng.choice(equipment[activity]),
+            'km': km,
+            'tss': int(seconds / 36 * rng.uniform(0.4, 1.1)),
+            'rpe': round(rng.uniform(2.0, 9.5), 1),
+            'hr': rng.randint(110, 165),
+            'watts': rng.randint(0, 320),
+            'seconds': seconds,
+            'ascentMetres': rng.randint(0, 1500),
+            'kj': rng.randint(0, 3000),
+            'reps': rng.randint(0, 100) if activity == 'Gym' else 0,
+            'isRace': rng.random() < 0.03,
+            'brick': rng.random() < 0.05,
+            'wattsEstimated': rng.random() < 0.5,
+            'cadence': rng.randint(60, 100)}
+
+
+def synthetic_weights(rng, start, number_of_days):
+    kg = 75.0
+    for i in range(number_of_days):
+        kg = min(max(kg + rng.uniform(-0.3, 0.3), 65.0), 85.0)
+        if rng.random() < 0.3:
+            fat = 0.0
+            if rng.random() < 0.7:
+                fat = round(rng.uniform(10.0, 16.0), 1)
+            yield {'iso8061DateString': iso_string(start + datetime.timedelta(days=i)), 'kg': round(kg, 1),
+                   'fatPercent': fat}
+
+
+def synthetic_physiologicals(rng, start, number_of_days):
+    for i in range(number_of_days):
+        if rng.random() < 0.3:
+            yield {'iso8061DateString': iso_string(start + datetime.timedelta(days=i)),
+                   'restingHR': rng.randint(38, 55) if rng.random() < 0.9 else None,
+                   'restingSDNN': round(rng.uniform(40.0, 100.0), 1),
+                   'restingRMSSD': round(rng.uniform(30.0, 90.0), 1)}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('path', nargs='?', default='TrainingDiary.json')
+    arg_parser.add_argument('--years', type=float, default=20)
+    arg_parser.add_argument('--seed', type=int, default=1)
+    arg_parser.add_argument('--workouts', type=int, default=3, help='most workouts on a training day')
+    arg_parser.add_argument('--equipment', type=int, help='named pieces of equipment per activity')
+    args = arg_parser.parse_args()
+
+    n = write_diary(args.path, years=args.years, seed=args.seed, workouts=args.workouts, equipment=args.equipment)
+    print(f'Written {n} days to {args.path}')
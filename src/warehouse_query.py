@@ -0,0 +1,172 @@
+import os
+import time
+import argparse
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from db_connection import DB_NAME, SERVING, connect
+from populate_from_json import DAY, WEEK, MONTH, load_generation
+
+QUERY_CACHE_SIZE = 256
+FLOAT_TYPES = ['REAL']
+INTEGER_TYPES = ['INTEGER', 'BOOLEAN']
+
+
+# Reads date ranges of columns from the warehouse tables for dashboards. Tables are found by period, activity,
+# activity type and equipment through the Tables catalog and results are kept in a least recently used cache of
+# cache_size queries. The load generation is read once per connection and again only when PRAGMA data_version
+# shows another connection has committed since, which costs no disk read, so a repeated query never reads the
+# tables. A load that moved the generation on drops the cache. The connection is reopened when the file has been
+# swapped for a new build, which data_version cannot show as the old file is never written again
+class WarehouseReader:
+
+    def __init__(self, db_name=DB_NAME, cache_size=QUERY_CACHE_SIZE):
+        self.db_name = db_name
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.conn = None
+        self.inode = None
+        self.data_version = None
+        self.generation = None
+        self.tables = dict()
+        self.table_columns = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def refresh(self):
+        inode = os.stat(self.db_name).st_ino
+        if self.conn is None or inode != self.inode:
+            self.close()
+            self.conn = connect(SERVING, self.db_name)
+            self.inode = inode
+            self.data_version = None
+            self.generation = None
+
+        data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self.data_version:
+            return
+        self.data_version = data_version
+        generation = load_generation(self.conn)
+        if generation != self.generation:
+            self.cache.clear()
+            self.table_columns.clear()
+            self.tables = {(period, activity, activity_type, equipment): table_name
+                           for period, activity, activity_type, equipment, table_name
+                           in self.conn.execute('SELECT period, activity, activity_type, equipment, table_name '
+                                                'FROM Tables')}
+            self.generation = generation
+
+    # equipment is matched as it appears in table names, without spaces
+    def table_name(self, period=DAY, activity='All', activity_type='All', equipment='All'):
+        self.refresh()
+        key = (period, activity, activity_type, equipment.replace(' ', ''))
+        if key not in self.tables:
+            raise KeyError(f'No {period} table for activity {activity}, type {activity_type}, equipment {equipment}')
+        return self.tables[key]
+
+    # column name -> declared type, read once per table and generation
+    def column_types(self, table_name):
+        types = self.table_columns.get(table_name)
+        if types is None:
+            types = {row[1]: row[2].upper() for row in self.conn.execute(f'PRAGMA table_info({table_name})')}
+            self.table_columns[table_name] = types
+        return types
+
+    # {'date': datetime64[D] array, column: array, ...} for the rows dated start to end inclusive, in date order.
+    # The arrays are shared with the cache so they are read only
+    def arrays(self, columns, period=DAY, activity='All', activity_type='All', equipment='All', start=None,
+               end=None):
+        table_name = self.table_name(period, activity, activity_type, equipment)
+        key = (table_name, tuple(columns), None if start is None else str(start), None if end is None else str(end))
+        result = self.cache.get(key)
+        if result is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        result = self.read(table_name, columns, key[2], key[3])
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    # the same as arrays as a DataFrame indexed by date
+    def frame(self, columns, period=DAY, activity='All', activity_type='All', equipment='All', start=None,
+              end=None):
+        result = self.arrays(columns, period, activity, activity_type, equipment, start, end)
+        return pd.DataFrame({c: result[c] for c in columns}, index=pd.DatetimeIndex(result['date'], name='date'))
+
+    def read(self, table_name, columns, start, end):
+        types = self.column_types(table_name)
+        unknown = [c for c in columns if c not in types]
+        if len(unknown) > 0:
+            raise ValueError(f'{table_name} has no column {", ".join(unknown)}')
+
+        conditions = []
+        parameters = []
+        if start is not None:
+            conditions.append('date >= ?')
+            parameters.append(start)
+        if end is not None:
+            conditions.append('date <= ?')
+            parameters.append(end)
+        sql_str = f'SELECT date, {", ".join(columns)} FROM {table_name}'
+        if len(conditions) > 0:
+            sql_str += f' WHERE {" AND ".join(conditions)}'
+        sql_str += ' ORDER BY date'
+        rows = self.conn.execute(sql_str, parameters).fetchall()
+
+        values = list(zip(*rows)) if len(rows) > 0 else [()] * (len(columns) + 1)
+        result = {'date': np.array(values[0], dtype='datetime64[D]')}
+        for c, column_values in zip(columns, values[1:]):
+            result[c] = column_array(column_values, types[c])
+        for array in result.values():
+            array.flags.writeable = False
+        return result
+
+
+# REAL columns as float with NaN for NULL, INTEGER and BOOLEAN columns as int unless they hold a NULL
+def column_array(values, column_type):
+    if column_type in FLOAT_TYPES:
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    if column_type in INTEGER_TYPES:
+        if None in values:
+            return np.array([np.nan if v is None else v for v in values], dtype=float)
+        return np.array(values, dtype=np.int64)
+    return np.array(values, dtype=object)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('columns', nargs='+')
+    arg_parser.add_argument('--period', choices=[DAY, WEEK, MONTH], default=DAY)
+    arg_parser.add_argument('--activity', default='All')
+    arg_parser.add_argument('--activity-type', default='All')
+    arg_parser.add_argument('--equipment', default='All')
+    arg_parser.add_argument('--start', help='first date, YYYY-MM-DD')
+    arg_parser.add_argument('--end', help='last date, YYYY-MM-DD')
+    args = arg_parser.parse_args()
+
+    with WarehouseReader() as reader:
+        query = (args.columns, args.period, args.activity, args.activity_type, args.equipment, args.start, args.end)
+        s = time.perf_counter()
+        df = reader.frame(*query)
+        first = time.perf_counter() - s
+        s = time.perf_counter()
+        reader.frame(*query)
+        cached = time.perf_counter() - s
+        print(df)
+        print(f'{len(df)} rows from {reader.table_name(*query[1:5])} in {first * 1000:.2f}ms, '
+              f'{cached * 1000:.3f}ms from the cache')